@@ -0,0 +1,66 @@
+#! /usr/bin/env python3
+
+'''
+Compares classifying a synthetic listing of a million names one at a time
+with get_longest_extension against a single classify_many call.
+
+Run from the root directory of the project:
+  python3 -m benchmarks.classify_many
+'''
+
+import random
+import time
+
+from huepy import *
+
+from cleanup.cleanup import FILE_TYPES, classify_many, get_longest_extension
+
+LISTING_SIZE = 1000000
+
+# a download directory: a few dozen extensions repeated many times over
+EXTENSIONS = ['jpg', 'JPG', 'png', 'mp4', 'mkv', 'pdf', 'docx', 'xlsx', 'zip',
+              'tar.gz', 'tar.xz', 'iso', 'mp3', 'flac', 'txt', 'csv', 'json',
+              'html', 'epub', 'exe', 'msi', 'dmg', 'deb', 'torrent', 'part',
+              'crdownload', 'svg', 'webm', 'mov', 'heic']
+
+
+def synthetic_listing(size):
+    random.seed(0)
+    listing = []
+    for i in range(size):
+        if i % 50 == 0:
+            listing.append('download-' + str(i))
+        else:
+            listing.append('file-' + str(i) + '.' + random.choice(EXTENSIONS))
+    return listing
+
+
+def one_at_a_time(listing):
+    results = []
+    for name in listing:
+        extension = get_longest_extension(name)
+        results.append((name, extension,
+                        FILE_TYPES[extension] if extension else None))
+    return results
+
+
+def timed(function, listing):
+    start = time.perf_counter()
+    results = list(function(listing))
+    return time.perf_counter() - start, results
+
+
+def main():
+    listing = synthetic_listing(LISTING_SIZE)
+    get_longest_extension('warm.up')
+    single, expected = timed(one_at_a_time, listing)
+    batch, results = timed(classify_many, listing)
+    if results != expected:
+        raise AssertionError('classify_many disagrees with get_longest_extension')
+    print(bold('Classifying ' + str(LISTING_SIZE) + ' names, seconds:'))
+    print('  one at a time   ' + yellow('%.2f' % single))
+    print('  classify_many   ' + lightgreen('%.2f' % batch))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#! /usr/bin/env python3
+
+'''
+Compares the per-name cost of the reverse-suffix trie in
+get_longest_extension against the split/join/upper lookup it replaced.
+
+Run from the root directory of the project:
+  python3 -m benchmarks.extensions
+'''
+
+import random
+import timeit
+
+from huepy import *
+
+from cleanup.cleanup import get_longest_extension
+from cleanup.file_types import FILE_TYPES
+
+SAMPLE_SIZE = 100000
+
+
+def legacy_get_longest_extension(filename):
+    parts = filename.split('.')
+    if len(parts) > 3:
+        extension = '.'.join(parts[-3:]).upper()
+        if FILE_TYPES.get(extension):
+            return extension
+    if len(parts) > 2:
+        extension = '.'.join(parts[-2:]).upper()
+        if FILE_TYPES.get(extension):
+            return extension
+    if len(parts) > 1:
+        extension = parts[-1].upper()
+        if FILE_TYPES.get(extension):
+            return extension
+    return None
+
+
+def sample_names(count):
+    random.seed(0)
+    extensions = [extension.lower() for extension in FILE_TYPES]
+    stems = ['IMG_2041', 'report final', 'setup', 'notes',
+             'Screen Recording 2023-04-01 at 10.32.11', 'backup.v2.final']
+    names = []
+    for i in range(count):
+        stem = random.choice(stems) + str(i)
+        if i % 10 == 0:
+            names.append(stem)  # no extension at all
+        elif i % 10 == 1:
+            names.append(stem + '.unknownext')
+        else:
+            names.append(stem + '.' + random.choice(extensions))
+    return names
+
+
+def bench(function, names):
+    best = min(timeit.repeat(lambda: [function(name) for name in names],
+                             number=1, repeat=5))
+    return best / len(names) * 1e9
+
+
+def main():
+    names = sample_names(SAMPLE_SIZE)
+    get_longest_extension('warm.up')   # build the trie outside the timings
+    for name in names:
+        if get_longest_extension(name) != legacy_get_longest_extension(name):
+            raise AssertionError('results differ for ' + name)
+    dotted = [name for name in names if name.count('.') > 2]
+    print(bold('get_longest_extension, ns per name:'))
+    for label, sample in (('all names', names), ('dotted stems', dotted)):
+        legacy = bench(legacy_get_longest_extension, sample)
+        trie = bench(get_longest_extension, sample)
+        print('  ' + label)
+        print('    split/join/upper  ' + yellow('%.0f' % legacy))
+        print('    reverse trie      ' + lightgreen('%.0f' % trie))
+
+
+if __name__ == '__main__':
+    main()
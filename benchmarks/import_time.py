@@ -0,0 +1,52 @@
+#! /usr/bin/env python3
+
+'''
+Compares the start-up cost of importing the FILE_TYPES dict literal against
+memory-mapping the compiled extension table, each including a first lookup.
+
+Run from the root directory of the project:
+  python3 -m benchmarks.import_time
+'''
+
+import os
+import subprocess
+import sys
+import time
+
+from huepy import *
+
+RUNS = 20
+
+# the command line tool imports these before it looks at any extension
+BASELINE = 'import json, docopt, huepy, cleanup'
+LEGACY = BASELINE + ('; from cleanup.file_types import FILE_TYPES; '
+                     'FILE_TYPES.get("JPG")')
+TABLE = BASELINE + ('; from cleanup.extension_table import FILE_TYPES; '
+                    'FILE_TYPES.trie["JPG"]')
+
+
+def bench(statement):
+    env = dict(os.environ)
+    # let the interpreter cache bytecode, as an installed package would
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    subprocess.run([sys.executable, '-c', statement], env=env, check=True)
+    best = None
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', statement], env=env, check=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1e3
+
+
+def main():
+    baseline = bench(BASELINE)
+    legacy = bench(LEGACY) - baseline
+    table = bench(TABLE) - baseline
+    print(bold('Extension table start-up, ms over the other imports of the tool:'))
+    print('  dict literal   ' + yellow('%.1f' % legacy))
+    print('  mmap table     ' + lightgreen('%.1f' % table))
+
+
+if __name__ == '__main__':
+    main()
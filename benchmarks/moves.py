@@ -0,0 +1,117 @@
+#! /usr/bin/env python3
+
+'''
+Counts the filesystem calls made to move files into their category
+subdirectories and back, with os.renames per file against the move engines.
+
+Run from the root directory of the project:
+  python3 -m benchmarks.moves
+'''
+
+import os
+import tempfile
+import time
+from collections import Counter
+
+from huepy import *
+
+from cleanup.move import DIR_FD_SUPPORTED, FdMover, Mover
+
+FILE_COUNT = 10000
+CATEGORIES = ['Video', 'Audio', 'Text', 'Raster image', 'Compressed']
+
+# directories between the temporary directory and the one being cleaned, as
+# path lookups get dearer the deeper a directory is
+DEPTH = 32
+
+# os.makedirs, os.removedirs and os.path.exists all go through these
+COUNTED = ['stat', 'mkdir', 'rmdir', 'rename', 'open']
+
+
+class counting:
+    '''
+    Counts the calls made to the COUNTED os functions inside a with block.
+    '''
+
+    def __init__(self):
+        self.calls = Counter()
+        self.originals = {}
+
+    def wrap(self, name):
+        function = self.originals[name] = getattr(os, name)
+
+        def counted(*args, **kwargs):
+            self.calls[name] += 1
+            return function(*args, **kwargs)
+        return counted
+
+    def __enter__(self):
+        for name in COUNTED:
+            setattr(os, name, self.wrap(name))
+        return self.calls
+
+    def __exit__(self, *exc_info):
+        for name, function in self.originals.items():
+            setattr(os, name, function)
+
+
+def create_files(root_dir):
+    files = []
+    for i in range(FILE_COUNT):
+        name = 'file-' + str(i)
+        open(os.path.join(root_dir, name), 'w').close()
+        files.append((name, CATEGORIES[i % len(CATEGORIES)]))
+    return files
+
+
+def legacy(root_dir, files):
+    for name, file_type in files:
+        os.renames(os.path.join(root_dir, name),
+                   os.path.join(root_dir, file_type, name))
+    for name, file_type in files:
+        os.renames(os.path.join(root_dir, file_type, name),
+                   os.path.join(root_dir, name))
+
+
+def moved_by(mover_class):
+    def move(root_dir, files):
+        with mover_class(root_dir) as mover:
+            for name, file_type in files:
+                mover.move(name, file_type)
+            for name, file_type in files:
+                mover.move_back(name, file_type)
+            mover.prune(CATEGORIES)
+    return move
+
+
+def measure(function):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root_dir = os.path.join(temp_dir, *['nested'] * DEPTH)
+        os.makedirs(root_dir)
+        files = create_files(root_dir)
+        with counting() as calls:
+            start = time.perf_counter()
+            function(root_dir, files)
+            elapsed = time.perf_counter() - start
+        if len(os.listdir(root_dir)) != FILE_COUNT:
+            raise AssertionError('files were not all moved back')
+    return calls, elapsed
+
+
+def main():
+    print(bold('Moving ' + str(FILE_COUNT) + ' files into '
+               + str(len(CATEGORIES)) + ' categories and back, '
+               + str(DEPTH) + ' directories deep:'))
+    engines = [('os.renames', legacy), ('Mover', moved_by(Mover))]
+    if DIR_FD_SUPPORTED:
+        engines.append(('FdMover', moved_by(FdMover)))
+    for label, function in engines:
+        calls, elapsed = measure(function)
+        total = sum(calls.values())
+        counts = ', '.join(name + ' ' + str(calls[name]) for name in COUNTED)
+        print('  %-11s %s calls (%s) in %.2fs'
+              % (label, bold(str(total)), counts, elapsed))
+
+
+if __name__ == '__main__':
+    main()
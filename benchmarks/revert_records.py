@@ -0,0 +1,84 @@
+#! /usr/bin/env python3
+
+'''
+Compares the size of the revert info of a large cleanup, and the time taken to
+parse it, between the pretty-printed JSON document of earlier versions, a JSON
+lines record, and the compact format of the records module.
+
+Run from the root directory of the project:
+  python3 -m benchmarks.revert_records
+'''
+
+import io
+import json
+import time
+
+from huepy import *
+
+from cleanup.records import encode_record, flatten, group_files, iter_records
+
+ENTRY_COUNT = 1000000
+
+# (file type, name pattern) of the files moved, in turn
+PATTERNS = [
+    ('Raster image', 'IMG_2019%04d_%06d.jpg'),
+    ('Audio', 'Artist %04d - Track %06d.mp3'),
+    ('Text', 'notes-%04d-%06d.txt'),
+    ('Video', 'VID_2019%04d_%06d.mp4'),
+    ('Document', 'report %04d (%06d).pdf'),
+]
+
+
+def create_files():
+    files = []
+    for i in range(ENTRY_COUNT):
+        file_type, pattern = PATTERNS[i % len(PATTERNS)]
+        files.append({
+            'name': pattern % (i // 1000, i),
+            'type': file_type
+        })
+    return files
+
+
+def legacy(files):
+    data = json.dumps({'/dir': files}, ensure_ascii=False, sort_keys=True,
+                      indent=4, separators=(',', ': ')).encode('utf8')
+    return data, lambda: json.loads(data)['/dir']
+
+
+def json_lines(files):
+    data = (json.dumps({'path': '/dir', 'files': files}) + '\n').encode()
+    return data, lambda: json.loads(data)['files']
+
+
+def compact(files):
+    data = b''.join(encode_record({'path': '/dir'}, group_files(files)))
+
+    def parse():
+        return [group for header, groups in iter_records(io.BytesIO(data))
+                for group in groups]
+    return data, parse
+
+
+def compact_flattened(files):
+    data, parse = compact(files)
+    return data, lambda: flatten(parse())
+
+
+def main():
+    files = create_files()
+    print(bold('Revert info of ' + str(ENTRY_COUNT) + ' moved files in '
+               + str(len(PATTERNS)) + ' categories:'))
+    formats = [('pretty JSON', legacy), ('JSON lines', json_lines),
+               ('compact', compact), ('compact, as dicts', compact_flattened)]
+    for label, encode in formats:
+        data, parse = encode(files)
+        start = time.perf_counter()
+        parse()
+        elapsed = time.perf_counter() - start
+        print('  %-18s %s MB, parsed in %.2fs'
+              % (label, bold('%.1f' % (len(data) / 1e6)), elapsed))
+
+
+if __name__ == '__main__':
+    main()
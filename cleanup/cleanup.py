@@ -4,66 +4,181 @@
 Organise files in a directory into subdirectories based on their extensions.
 
 Usage:
-  cleanup [-d | -s] [-r] <dir>
+  cleanup [-d | -s | --progress]
+          [-r [--to <gen>] [--type <type>]... [--match <glob>]]
+          [-R] [--sniff] [-j <n>] [--store <store>] <dir>
+  cleanup --history [--store <store>] <dir>
+  cleanup --resume [-s | --progress] [--sniff] [-j <n>] [--store <store>]
+          <dir>
+  cleanup -w [--poll [--settle <s>]] [-s] [--sniff] [-j <n>]
+             [--store <store>] <dir>
   cleanup -h
 
 Options:
   -d, --dry-run     Just display the changes that would be made, without
                     actually doing anything.
   -s, --silent      Do not display information while performing operations.
-  -r, --revert      Revert previous cleanup of the directory.
+  --progress        Display a single status line, with the number of files
+                    moved per second, their size, the number of each type
+                    and the time left, instead of a line for every file.
+                    Not available with --recursive.
+  -r, --revert      Revert the latest cleanup of the directory, or roll back
+                    one that was interrupted.
+  --to <gen>        Revert every cleanup of the directory after the given
+                    generation instead, where 0 reverts them all.
+  --type <type>     Only revert the moves of files of the given type, which
+                    can be given more than once. The other moves can still
+                    be reverted later.
+  --match <glob>    Only revert the moves of files whose names match the
+                    given pattern, such as '*.mkv'.
+  --history         List the cleanups of the directory that can be reverted,
+                    by generation.
+  -R, --recursive   Also clean up, or revert the cleanup of, every directory
+                    below the directory, leaving out the category
+                    directories that its cleanups moved files to.
+  --resume          Finish a cleanup of the directory that was interrupted.
+  --sniff           Identify files without a known extension by reading the
+                    first few bytes of their content.
+  -w, --watch       Keep running, and organise files as they arrive in the
+                    directory.
+  --poll            Watch by listing the directory every so often instead of
+                    with inotify, which misses changes made from other NFS
+                    clients and on many FUSE filesystems.
+  --settle <s>      Seconds for which the size of a file must not change before
+                    a poll moves it [default: 5].
+  -j, --jobs <n>    Number of files to move at once, which speeds up cleaning
+                    up and reverting directories on network filesystems.
+                    With --recursive, the number of directories to process
+                    at once instead.
+  --store <store>   Where to keep the information needed to revert cleanups,
+                    either journal, a small file per directory, or sqlite, a
+                    database that can be queried with
+                    python3 -m cleanup.sqlite_store [default: journal].
   -h, --help        Display this help text.
 '''
 
-import io
-import json
+import itertools
 import os
+import time
+from collections import Counter
+from fnmatch import fnmatch
+from functools import lru_cache
 
-from docopt import docopt
+from docopt import DocoptExit, docopt
 from huepy import *
 
-from .file_types import FILE_TYPES
-
-REVERT_INFO_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)),
-                                'revert_info.json')
+from .extension_table import FILE_TYPES
+from .inotify import (IN_CLOSE_WRITE, IN_DELETE_SELF, IN_IGNORED, IN_ISDIR,
+                      IN_MOVED_TO, IN_Q_OVERFLOW, Inotify, load_libc)
+from . import journal
+from .journal import WriteAheadLog, is_interrupted
+from .move import open_mover, plan_moves_back, run_ordered, stamp
+from .output import Progress, describe_files, output
+from .records import file_stamps
+from .sniff import classify_by_content
+from .walk import WALK_JOBS, walk_parallel
+
+# seconds without new events after which files that arrived are moved
+WATCH_DEBOUNCE = 0.5
+# seconds after which files that arrived are moved even if events keep coming
+WATCH_MAX_DELAY = 5
+# files that arrived after which they are moved even if events keep coming
+WATCH_BATCH = 1000
+# seconds after which an idle watch checks that the directory is still there
+WATCH_CHECK_INTERVAL = 2
+# seconds after which a watch tries again to move a batch of files that it
+# couldn't move while another cleanup of the directory was running
+WATCH_RETRY_DELAY = 5
+
+# seconds between polls while files are arriving, and the most they back off
+# to while the directory is idle
+POLL_MIN_INTERVAL = 1
+POLL_MAX_INTERVAL = 60
+# seconds after its modification time within which a directory is listed again
+# even if its modification time hasn't changed, as it may be coarse
+POLL_MTIME_SLACK = 2
+
+
+def walk_extension_trie(filename):
+    '''
+    Walks the extension trie one dot-separated part of the given filename at a
+    time, from the end. Returns the longest known extension found, and the
+    last trie node reached if every part after the first dot matched, since
+    only then could a longer name ending in the same parts have a longer
+    extension.
+    '''
+    dot = filename.rfind('.')
+    if dot < 0:
+        return None, None
+    node = FILE_TYPES.trie[filename[dot + 1:].upper()]
+    extension = None
+    while node is not None:
+        extension = node.get('.', extension)
+        end = dot
+        dot = filename.rfind('.', 0, end)
+        if dot < 0:
+            break
+        node = node.get(filename[dot + 1:end].upper())
+    return extension, node
 
 
 def get_longest_extension(filename):
     '''
     Returns the longest known extension from the given filename
     '''
-    parts = filename.split('.')
-    if len(parts) > 3:
-        # possible triple extension (.pkg.tar.xz)
-        extension = '.'.join(parts[-3:]).upper()
-        if FILE_TYPES.get(extension):
-            return extension
-    if len(parts) > 2:
-        # possible double extension (.tar.gz)
-        extension = '.'.join(parts[-2:]).upper()
-        if FILE_TYPES.get(extension):
-            return extension
-    if len(parts) > 1:
-        # possible single extension (.zip)
-        extension = parts[-1].upper()
-        if FILE_TYPES.get(extension):
-            return extension
-    return None
+    return walk_extension_trie(filename)[0]
 
 
-def save_revert_info(revert_info):
-    with io.open(REVERT_INFO_FILE, 'w', encoding='utf8') as file:
-        file.write(json.dumps(revert_info, ensure_ascii=False, sort_keys=True,
-                              indent=4, separators=(',', ': ')))
+def classify_suffix(suffix):
+    '''
+    Returns the (extension, file type, open ended) memo entry for the given
+    suffix, where open ended tells whether a longer suffix could still match a
+    longer extension.
+    '''
+    extension, node = walk_extension_trie(suffix)
+    file_type = FILE_TYPES[extension] if extension else None
+    open_ended = node is not None and len(node) > ('.' in node)
+    return extension, file_type, open_ended
 
 
-def read_revert_info():
-    with io.open(REVERT_INFO_FILE) as file:
-        return json.load(file)
+def classify_many(names):
+    '''
+    Yields a (name, extension, file type) tuple for each of the given
+    filenames, with None as the extension and file type of names that have no
+    known extension. Results are memoised by each name's lower-cased trailing
+    suffix, which starts at its last dot and only takes in another part while
+    a longer extension could still match.
+    '''
+    memo = {}
+    for name in names:
+        extension = file_type = None
+        dot = name.rfind('.')
+        while dot >= 0:
+            suffix = name[dot:].lower()
+            entry = memo.get(suffix)
+            if entry is None:
+                entry = memo[suffix] = classify_suffix(suffix)
+            extension, file_type, open_ended = entry
+            if not open_ended:
+                break
+            dot = name.rfind('.', 0, dot)
+        yield name, extension, file_type
 
 
 def print_cleaning(action, dir):
-    print(action + ' ' + bold(lightblue(dir)) + ':')
+    output.flush(action + ' ' + bold(lightblue(dir)) + ':')
+
+
+@lru_cache(maxsize=None)
+def move_prefix(move_action, dry_run):
+    if dry_run:
+        return yellow(move_action) + ' '
+    return lightgreen(move_action) + ' '
+
+
+@lru_cache(maxsize=None)
+def type_suffix(preposition, file_type):
+    return ' ' + preposition + ' ' + bold(file_type)
 
 
 def print_move(move_action, file, file_type, revert=False, dry_run=False):
@@ -71,12 +186,8 @@ def print_move(move_action, file, file_type, revert=False, dry_run=False):
         preposition = 'from'
     else:
         preposition = 'under'
-    if dry_run:
-        move_action = yellow(move_action)
-    else:
-        move_action = lightgreen(move_action)
-    print(move_action + ' ' + bold(file) + ' ' + preposition + ' '
-          + bold(file_type))
+    output.write(move_prefix(move_action, dry_run) + bold(file)
+                 + type_suffix(preposition, file_type))
 
 
 def print_file_error(error, file, file_type, dry_run=False):
@@ -84,108 +195,629 @@ def print_file_error(error, file, file_type, dry_run=False):
         preposition = 'from'
     else:
         preposition = 'under'
-    print(lightred(error) + ' ' + bold(file) + ' ' + preposition + ' '
-          + bold(file_type))
+    output.write(lightred(error) + ' ' + bold(file)
+                 + type_suffix(preposition, file_type))
 
 
 def print_dir_error(error, dir):
-    print(lightred(error) + ': ' + bold(lightblue(dir)))
+    output.flush(lightred(error) + ': ' + bold(lightblue(dir)))
 
 
 def print_complete(operation):
-    print(operation + ' ' + lightgreen('complete') + '!')
+    output.flush(operation + ' ' + lightgreen('complete') + '!')
+
+
+def print_interrupted(dir):
+    print_dir_error('A cleanup was interrupted, finish it with --resume or '
+                    'roll it back with --revert', dir)
+
 
+def print_running(dir):
+    print_dir_error('Another cleanup of the directory is running', dir)
 
-def revert(abs_path, dry_run=False, silent=False):
+
+def is_moved(abs_path, file, file_type):
+    '''
+    Returns whether a file logged by an interrupted cleanup was moved before
+    the cleanup was interrupted.
+    '''
+    return (not os.path.lexists(os.path.join(abs_path, file))
+            and os.path.lexists(os.path.join(abs_path, file_type, file)))
+
+
+def roll_back(wal, dry_run=False, silent=False, jobs=1):
     '''
-    Given the absolute path to a directory, it reverts the cleanup operation
-    performed on it and moves back files to their original location, deleting
-    empty folders that remain after files have been moved from them.
+    Given the write-ahead log of an interrupted cleanup, it moves back the
+    files that the cleanup had moved, up to the given number at once, and
+    removes the log.
     '''
+    abs_path = wal.abs_path
     try:
-        revert_info = read_revert_info()
-        if revert_info.get(abs_path):
-            file_info_list = revert_info[abs_path]
+        mover = open_mover(abs_path)
+    except OSError:
+        wal.close()
+        print_dir_error('The specified directory does not exist', abs_path)
+        return
+
+    if dry_run:
+        print_cleaning('When rolling back interrupted cleanup of', abs_path)
+    elif not silent:
+        print_cleaning('Rolling back interrupted cleanup of', abs_path)
+    with mover:
+        moves = plan_moves_back(mover, wal.moves)[0]
+        if dry_run:
+            for file, file_type in moves:
+                print_move('Will move back', file, file_type, revert=True, dry_run=True)
         else:
-            # revert info about the specified directory is not available
-            raise Exception
-    except:
-        # revert info file doesn't exist, so cannot perform a revert
-        print('Nothing to do.')
+            move_back_files(mover, moves, silent, jobs)
+        if not dry_run:
+            mover.prune(set(file_type for file, file_type in moves))
+    if dry_run:
+        wal.close()
+        return
+    wal.remove()
+    if not silent:
+        print_complete('Rollback')
+
+
+def move_back_files(mover, moves, silent=False, jobs=1, progress=None,
+                    stamps=None):
+    '''
+    Moves the files of the given (name, file type) moves back out of their
+    category subdirectories, up to the given number of jobs at once. The
+    moves are taken a category at a time, so that the jobs mostly rename
+    files out of the same subdirectory. Files moved are counted by the given
+    progress, if any, with their sizes from the given stamps, instead of
+    being printed. Returns the set of the moves that were made.
+    '''
+    moved = set()
+    by_type = {}
+    for file, file_type in moves:
+        by_type.setdefault(file_type, []).append((file, file_type))
+    for (file, file_type), error in run_ordered(
+            mover.move_back, itertools.chain(*by_type.values()), jobs):
+        if error:
+            print_file_error('Could not find', file, file_type)
+            continue
+        moved.add((file, file_type))
+        if progress is not None:
+            file_stamp = stamps.get(file) if stamps else None
+            progress.update(file_type, file_stamp and file_stamp[1])
+        elif not silent:
+            print_move('Moved back', file, file_type, revert=True)
+    return moved
+
+
+def latest_moves(generations):
+    '''
+    Returns the revert list of the given generations, with only the latest
+    move of each file name, as the files of that name moved before it were
+    replaced by it.
+    '''
+    latest = {}
+    for generation, run_time, revert_list in generations:
+        for file_info in revert_list:
+            latest[file_info['name']] = file_info
+    return list(latest.values())
+
+
+def revert(abs_path, dry_run=False, silent=False, store=journal, to=None,
+           jobs=1, file_types=None, pattern=None, progress=False):
+    '''
+    Given the absolute path to a directory, it reverts the latest cleanup
+    operation performed on it, or every one after the given generation, and
+    moves back files to their original location, deleting empty folders that
+    remain after files have been moved from them. Each file is moved back
+    with a single rename, however many of the cleanups moved a file of its
+    name, up to the given number of files at once. If a cleanup of the
+    directory was interrupted, only that one is rolled back. Revert info is
+    read from the given store.
+
+    If file types or a pattern are given, only the moves of files of those
+    types whose names match the pattern are reverted, and the others are kept
+    to be reverted later. So are the moves of files that were kept in place or
+    failed, while those of files that are gone are forgotten. With progress,
+    a status line is shown instead of a line for every file.
+    '''
+    wal = WriteAheadLog.open_interrupted(abs_path)
+    if wal is not None:
+        roll_back(wal, dry_run, silent, jobs)
+        return
+
+    if to is None:
+        to = max(store.last_generation(abs_path) - 1, 0)
+    file_types = set(file_types) if file_types else None
+    generations = store.read_generations(abs_path, to, file_types)
+    if pattern is not None:
+        generations = [(generation, run_time,
+                        [file_info for file_info in revert_list
+                         if fnmatch(file_info['name'], pattern)])
+                       for generation, run_time, revert_list in generations]
+    file_info_list = latest_moves(generations)
+    if not file_info_list:
+        # no revert info about the specified directory is available
+        output.flush('Nothing to do.')
+        return
+
+    try:
+        mover = open_mover(abs_path)
+    except OSError:
+        print_dir_error('The specified directory does not exist', abs_path)
         return
 
     if dry_run:
         print_cleaning('When reverting cleanup of', abs_path)
     elif not silent:
         print_cleaning('Reverting cleanup of', abs_path)
-    for file_info in file_info_list:
-        file_type = file_info['type']
-        file = file_info['name']
-        prev_path = os.path.join(abs_path, file_type, file)
-        new_path = os.path.join(abs_path, file)
-        try:
+    with mover:
+        stamps = file_stamps(file_info_list)
+        to_move, missing, conflicting, changed = plan_moves_back(
+            mover, [(file_info['name'], file_info['type'])
+                    for file_info in file_info_list], stamps)
+        if dry_run:
+            for file, file_type in to_move:
+                print_move('Will move back', file, file_type, revert=True, dry_run=True)
+        else:
+            if progress:
+                progress = Progress(len(to_move))
+            moved = move_back_files(mover, to_move, silent, jobs,
+                                    progress or None, stamps)
+        for file, file_type in missing:
             if dry_run:
-                if os.path.exists(prev_path):
-                    print_move('Will move back', file, file_type, revert=True, dry_run=True)
-                else:
-                    print_file_error('Will fail to move back', file, file_type, dry_run=True)
+                print_file_error('Will fail to move back', file, file_type, dry_run=True)
             else:
-                os.renames(prev_path, new_path)
-                if not silent:
-                    print_move('Moved back', file, file_type, revert=True)
-        except:
-            print_file_error('Could not find', file, file_type)
+                print_file_error('Could not find', file, file_type)
+        for file, file_type in conflicting:
+            if dry_run:
+                print_file_error('Will keep in place, name taken:', file, file_type)
+            else:
+                print_file_error('Kept in place, name taken:', file, file_type)
+        for file, file_type in changed:
+            if dry_run:
+                print_file_error('Will keep in place, changed since cleanup:', file, file_type)
+            else:
+                print_file_error('Kept in place, changed since cleanup:', file, file_type)
+        if not dry_run:
+            mover.prune(set(file_info['type'] for file_info in file_info_list))
     if not dry_run:
-        if not silent:
+        if progress:
+            progress.finish('Revert')
+        elif not silent:
             print_complete('Revert')
-        revert_info.pop(abs_path)
-        save_revert_info(revert_info)
+        # the moves of files kept in place, or that failed, are not forgotten,
+        # so that they can still be moved back by a later revert, while those
+        # of files that are gone are
+        kept = set(conflicting) | set(changed) | (set(to_move) - moved)
+        if file_types is None and pattern is None and not kept:
+            store.drop_generations(abs_path, to)
+        else:
+            forgotten = set((file_info['name'], file_info['type'])
+                            for file_info in file_info_list) - kept
+            store.drop_generations(abs_path, to, lambda name, file_type:
+                                   (name, file_type) in forgotten)
 
 
-def cleanup(abs_path, dry_run=False, silent=False):
+def print_history(abs_path, store=journal):
     '''
-    Given the absolute path to a directory, it organise files in that directory
-    into subdirectories based on the files' extensions.
+    Lists the generations of cleanups of the given directory that can be
+    reverted, with when each ran and how many files of each type it moved.
     '''
-    root_dir, dir_list, file_list = next(os.walk(abs_path), (None, [], []))
-    if not root_dir:
-        print_dir_error('The specified directory does not exist', abs_path)
+    generations = store.read_generations(abs_path)
+    if not generations:
+        output.flush('Nothing to do.')
         return
+    print_cleaning('Cleanups of', abs_path)
+    for generation, run_time, revert_list in generations:
+        if run_time is None:
+            when = 'before history was kept'
+        else:
+            when = time.strftime('%Y-%m-%d %H:%M',
+                                 time.localtime(run_time))
+        counts = Counter(file_info['type'] for file_info in revert_list)
+        output.flush(bold(str(generation)) + '  ' + when + '  '
+                     + describe_files(counts))
 
-    if len(file_list) == 0:
-        print('Nothing to do.')
-        return
-    if dry_run:
-        print_cleaning('When cleaning up', abs_path)
-    elif not silent:
-        print_cleaning('Cleaning up', abs_path)
 
+def recorded_types(abs_path, store=journal):
+    '''
+    Returns the file types of the moves recorded for the given directory, that
+    is the names of the subdirectories its cleanups moved files to.
+    '''
+    return set(file_info['type']
+               for generation, run_time, revert_list
+               in store.read_generations(abs_path)
+               for file_info in revert_list)
+
+
+def iter_files(entries, dirs):
+    '''
+    Yields the names of the files among the given directory entries as they
+    are read, and adds the names of the subdirectories among them to the given
+    set. DirEntry.is_file() and is_dir() go by the file type in the directory
+    listing, so no entry needs to be stat-ed.
+    '''
+    for entry in entries:
+        if entry.is_file():
+            yield entry.name
+        elif entry.is_dir():
+            dirs.add(entry.name)
+
+
+def move_info(file, file_type, file_stamp):
+    file_info = {'name': file, 'type': file_type}
+    if file_stamp is not None:
+        file_info['stamp'] = file_stamp
+    return file_info
+
+
+def move_files(mover, classified, silent=False, jobs=1, wal=None,
+               progress=None):
+    '''
+    Moves those of the given classified files that have a known file type into
+    their category subdirectories, up to the given number of jobs at once, and
+    returns the revert list of the files that were moved, stamped as they
+    were moved. Moves are written ahead to the given log, if any, a batch at
+    a time. Files moved are counted by the given progress, if any, instead of
+    being printed.
+    '''
     revert_list = []
-    for file in file_list:
-        extension = get_longest_extension(file)
-        if extension:
-            original_name = os.path.join(root_dir, file)
-            file_type = FILE_TYPES[extension]
-            new_name = os.path.join(root_dir, file_type, file)
+    stamps = {}
+
+    def move(file, file_type):
+        mover.move(file, file_type)
+        stamps[file] = stamp(mover, file, file_type)
+
+    moves = ((file, file_type) for file, extension, file_type in classified
+             if extension)
+    if wal is not None:
+        moves = wal.write_ahead(moves)
+    for (file, file_type), error in run_ordered(move, moves, jobs):
+        if error:
+            print_file_error('Could not move', file, file_type)
+            continue
+        file_stamp = stamps.pop(file)
+        revert_list.append(move_info(file, file_type, file_stamp))
+        if progress is not None:
+            progress.update(file_type, file_stamp and file_stamp[1])
+        elif not silent:
+            print_move('Moved', file, file_type)
+    return revert_list
+
+
+def finish_moves(mover, moves, silent=False):
+    '''
+    Makes those of the given moves, logged by an interrupted cleanup, that
+    weren't made before it was interrupted, and returns the revert list of
+    all the files that were moved.
+    '''
+    revert_list = []
+    for file, file_type in moves:
+        if not is_moved(mover.root_dir, file, file_type):
+            try:
+                mover.move(file, file_type)
+            except OSError:
+                print_file_error('Could not move', file, file_type)
+                continue
+            if not silent:
+                print_move('Moved', file, file_type)
+        revert_list.append(move_info(file, file_type,
+                                     stamp(mover, file, file_type)))
+    return revert_list
+
+
+def cleanup(abs_path, dry_run=False, silent=False, sniff=False, jobs=1,
+            resume=False, store=journal, progress=False):
+    '''
+    Given the absolute path to a directory, it organise files in that directory
+    into subdirectories based on the files' extensions. With sniff, files
+    without a known extension are organised based on their content. Up to the
+    given number of jobs files are moved at once. Moves are written ahead to a
+    log, so that a cleanup that is interrupted can be finished with resume,
+    and then recorded in the given store. With progress, the files to move
+    are counted up front, and a status line is shown instead of a line for
+    every file.
+    '''
+    wal = None
+    if not dry_run and is_interrupted(abs_path):
+        if not resume:
+            print_interrupted(abs_path)
+            return
+        wal = WriteAheadLog.open_interrupted(abs_path)
+    try:
+        mover = open_mover(abs_path)
+    except OSError:
+        if wal is not None:
+            wal.close()
+        print_dir_error('The specified directory does not exist', abs_path)
+        return
+
+    with mover:
+        revert_list = []
+        if wal is not None:
+            if not silent:
+                print_cleaning('Resuming cleanup of', abs_path)
+            # the logged moves are finished before listing the directory, so
+            # that the files they move aren't listed
+            revert_list = finish_moves(mover, wal.moves, silent or progress)
+        with mover.scandir() as entries:
+            files = iter_files(entries, mover.dirs)
+            first = next(files, None)
+            if first is None and wal is None:
+                output.flush('Nothing to do.')
+                return
             if dry_run:
-                print_move('Will move', file, file_type, dry_run=True)
-            else:
-                revert_list.append({
-                    'name': file,
-                    'type': file_type
-                })
-                os.renames(original_name, new_name)
+                print_cleaning('When cleaning up', abs_path)
+            elif wal is None:
+                try:
+                    wal = WriteAheadLog(abs_path)
+                except FileExistsError:
+                    print_running(abs_path)
+                    return
                 if not silent:
-                    print_move('Moved', file, file_type)
-    if not dry_run:
-        if not silent:
-            print_complete('Cleanup')
-        if os.path.exists(REVERT_INFO_FILE):
-            revert_info = read_revert_info()
-        else:
-            revert_info = {}
-        revert_info[os.path.abspath(root_dir)] = revert_list
-        save_revert_info(revert_info)
+                    print_cleaning('Cleaning up', abs_path)
+
+            if first is not None:
+                files = itertools.chain([first], files)
+            classified = classify_many(files)
+            if sniff:
+                classified = classify_by_content(abs_path, classified)
+            if dry_run:
+                for file, extension, file_type in classified:
+                    if extension:
+                        print_move('Will move', file, file_type, dry_run=True)
+                return
+            if progress:
+                classified = [(file, extension, file_type)
+                              for file, extension, file_type in classified
+                              if extension]
+                progress = Progress(len(classified))
+            revert_list += move_files(mover, classified, silent, jobs, wal,
+                                      progress or None)
+    if progress:
+        progress.finish('Cleanup')
+    elif not silent:
+        print_complete('Cleanup')
+    wal.commit(revert_list, store)
+
+
+def move_batch(mover, files, silent=False, sniff=False, jobs=1,
+               store=journal):
+    '''
+    Moves those of the given files that arrived in a watched directory and are
+    still there into their category subdirectories, and adds them to the revert
+    info of the directory in the given store in one update. Returns whether
+    the batch was moved, which it isn't while another cleanup of the directory
+    is running.
+    '''
+    abs_path = mover.root_dir
+    # a file may have left again before its batch was moved, or have been moved
+    # already by the first listing
+    files = [file for file in files
+             if os.path.isfile(os.path.join(abs_path, file))]
+    classified = classify_many(files)
+    if sniff:
+        classified = classify_by_content(abs_path, classified)
+    try:
+        wal = WriteAheadLog(abs_path, extend=True)
+    except FileExistsError:
+        print_running(abs_path)
+        return False
+    wal.commit(move_files(mover, classified, silent, jobs, wal), store)
+    return True
+
+
+def list_files(mover):
+    with mover.scandir() as entries:
+        return list(iter_files(entries, mover.dirs))
+
+
+def watch(abs_path, silent=False, sniff=False, jobs=1, store=journal):
+    '''
+    Given the absolute path to a directory, it organises the files in that
+    directory, and then keeps organising files as they arrive in it, once
+    they have been closed after writing or moved in. Files are moved in
+    batches, once events stop for WATCH_DEBOUNCE seconds, and each batch is
+    added to the revert info of the directory in one update. Falls back to
+    polling where inotify isn't available.
+    '''
+    if is_interrupted(abs_path):
+        print_interrupted(abs_path)
+        return
+    if load_libc() is None:
+        poll(abs_path, silent, sniff, jobs, store=store)
+        return
+    try:
+        mover = open_mover(abs_path)
+        inotify = Inotify(abs_path, IN_CLOSE_WRITE | IN_MOVED_TO
+                          | IN_DELETE_SELF)
+    except OSError:
+        print_dir_error('The specified directory does not exist', abs_path)
+        return
+
+    if not silent:
+        print_cleaning('Watching', abs_path)
+    pending = dict.fromkeys(list_files(mover))
+    first_arrival = time.monotonic()
+    with mover, inotify:
+        try:
+            while True:
+                now = time.monotonic()
+                if pending and (len(pending) >= WATCH_BATCH
+                                or now - first_arrival >= WATCH_MAX_DELAY):
+                    events = []
+                elif pending:
+                    events = inotify.read(min(WATCH_DEBOUNCE, first_arrival
+                                              + WATCH_MAX_DELAY - now))
+                else:
+                    events = inotify.read(WATCH_CHECK_INTERVAL)
+                if not events and pending:
+                    if move_batch(mover, list(pending), silent, sniff, jobs,
+                                  store):
+                        pending.clear()
+                    else:
+                        # the files stay pending, and events keep being
+                        # queued meanwhile
+                        time.sleep(WATCH_RETRY_DELAY)
+                    continue
+                if not events:
+                    # the removal of a directory that is held open is only
+                    # reported once it is closed, so look for it
+                    if not os.path.isdir(abs_path):
+                        print_dir_error('The directory is gone', abs_path)
+                        return
+                    continue
+                if not pending:
+                    first_arrival = time.monotonic()
+                for mask, name in events:
+                    if mask & IN_Q_OVERFLOW:
+                        # events were lost, so look for files in the listing
+                        pending.update(dict.fromkeys(list_files(mover)))
+                    elif mask & (IN_DELETE_SELF | IN_IGNORED):
+                        print_dir_error('The directory is gone', abs_path)
+                        return
+                    elif name and not mask & IN_ISDIR:
+                        pending[name] = None
+        except KeyboardInterrupt:
+            move_batch(mover, list(pending), silent, sniff, jobs, store)
+    if not silent:
+        print_complete('Watch')
+
+
+def rescan(mover, snapshot, now):
+    '''
+    Lists the directory of the given mover and brings the given poll snapshot
+    up to date with it. Returns whether any file is new or was replaced.
+    '''
+    listing = {}
+    with mover.scandir() as entries:
+        for entry in entries:
+            if entry.is_file():
+                listing[entry.name] = entry
+            elif entry.is_dir():
+                mover.dirs.add(entry.name)
+    for name in list(snapshot):
+        if name not in listing:
+            del snapshot[name]
+    changed = False
+    for name, entry in listing.items():
+        known = snapshot.get(name)
+        # DirEntry.inode() is free, so only files that are new or were replaced
+        # are stat-ed
+        if known is None or known[0] != entry.inode():
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            snapshot[name] = (entry.inode(), stat.st_size, stat.st_mtime_ns,
+                              now)
+            changed = True
+    return changed
+
+
+def find_settled(abs_path, snapshot, now, settle):
+    '''
+    Checks the files of the given poll snapshot that haven't settled yet, and
+    returns the names of those whose size and modification time have stayed
+    the same for the given number of seconds, and whether any of the others
+    changed.
+    '''
+    settled = []
+    changed = False
+    for name, (inode, size, mtime, since) in snapshot.items():
+        if since is None or since == now:
+            continue
+        try:
+            stat = os.stat(os.path.join(abs_path, name))
+        except OSError:
+            continue
+        if (stat.st_size, stat.st_mtime_ns) != (size, mtime):
+            snapshot[name] = (inode, stat.st_size, stat.st_mtime_ns, now)
+            changed = True
+        elif now - since >= settle:
+            settled.append(name)
+    return settled, changed
+
+
+def poll(abs_path, silent=False, sniff=False, jobs=1, settle=5,
+         store=journal):
+    '''
+    Given the absolute path to a directory, it keeps organising files as they
+    arrive in it by listing it every so often, moving a file once its size has
+    stayed the same for the given number of seconds. The directory is only
+    listed again when its modification time changes, and polls back off from
+    POLL_MIN_INTERVAL to POLL_MAX_INTERVAL seconds apart while nothing
+    arrives.
+    '''
+    if is_interrupted(abs_path):
+        print_interrupted(abs_path)
+        return
+    try:
+        mover = open_mover(abs_path)
+    except OSError:
+        print_dir_error('The specified directory does not exist', abs_path)
+        return
+
+    # name -> (inode, size, modification time, when the file last changed),
+    # where the last is None once the file has settled
+    snapshot = {}
+    dir_mtime = None
+    listed_at = 0
+    interval = POLL_MIN_INTERVAL
+    if not silent:
+        print_cleaning('Polling', abs_path)
+    with mover:
+        try:
+            while True:
+                now = time.monotonic()
+                try:
+                    stat = os.stat(abs_path)
+                except OSError:
+                    print_dir_error('The directory is gone', abs_path)
+                    return
+                changed = False
+                if (stat.st_mtime_ns != dir_mtime
+                        or listed_at - stat.st_mtime < POLL_MTIME_SLACK):
+                    dir_mtime = stat.st_mtime_ns
+                    listed_at = time.time()
+                    changed = rescan(mover, snapshot, now)
+                settled, grown = find_settled(abs_path, snapshot, now, settle)
+                if settled and move_batch(mover, settled, silent, sniff, jobs,
+                                          store):
+                    for name in settled:
+                        snapshot[name] = snapshot[name][:3] + (None,)
+                elif settled:
+                    # the files are left to be moved by a later poll
+                    time.sleep(WATCH_RETRY_DELAY)
+                pending = any(since is not None
+                              for _, _, _, since in snapshot.values())
+                if changed or grown or settled or pending:
+                    interval = POLL_MIN_INTERVAL
+                else:
+                    interval = min(interval * 2, POLL_MAX_INTERVAL)
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+    if not silent:
+        print_complete('Watch')
+
+
+def parse_number(arguments, option, convert, minimum):
+    '''
+    Returns the value of the given option converted by the given function, or
+    None if the option isn't given. Exits with the usage if the value isn't a
+    number, or is less than the given minimum.
+    '''
+    value = arguments[option]
+    if value is None:
+        return None
+    try:
+        number = convert(value)
+    except ValueError:
+        number = None
+    if number is None or not number >= minimum:
+        raise DocoptExit(option + ' must be a number of at least '
+                         + str(minimum) + ', not ' + repr(value))
+    return number
 
 
 def main():
@@ -194,12 +826,57 @@ def main():
     silent = arguments['--silent']
     dry_run = arguments['--dry-run']
     to_revert = arguments['--revert']
+    to_watch = arguments['--watch']
+    to_poll = arguments['--poll']
+    settle = parse_number(arguments, '--settle', float, 0)
+    recursive = arguments['--recursive']
+    resume = arguments['--resume']
+    progress = arguments['--progress']
+    to = parse_number(arguments, '--to', int, 0)
+    file_types = arguments['--type']
+    pattern = arguments['--match']
+    sniff = arguments['--sniff']
+    jobs = parse_number(arguments, '--jobs', int, 1)
+    if arguments['--store'] == 'sqlite':
+        from . import sqlite_store as store
+    elif arguments['--store'] == 'journal':
+        store = journal
+    else:
+        raise DocoptExit('Unknown store: ' + arguments['--store'])
+
+    if progress and recursive:
+        raise DocoptExit('--progress is not available with --recursive')
 
     abs_path = os.path.abspath(dir_path)
-    if to_revert:
-        revert(abs_path, dry_run, silent)
+    if arguments['--history']:
+        print_history(abs_path, store)
+    elif to_watch and to_poll:
+        poll(abs_path, silent, sniff, jobs or 1, settle, store)
+    elif to_watch:
+        watch(abs_path, silent, sniff, jobs or 1, store)
+    elif recursive:
+        # the output about each directory is written out in one piece, and
+        # the subdirectories its cleanups moved files to are not walked, while
+        # other subdirectories are, even if named like a file type
+        if to_revert:
+            def unit(path):
+                skip = recorded_types(path, store)
+                with output.grouped():
+                    revert(path, dry_run, silent, store, to,
+                           file_types=file_types, pattern=pattern)
+                return skip
+        else:
+            def unit(path):
+                with output.grouped():
+                    cleanup(path, dry_run, silent, sniff, store=store)
+                return recorded_types(path, store)
+        walk_parallel(abs_path, unit, jobs or WALK_JOBS)
+    elif to_revert:
+        revert(abs_path, dry_run, silent, store, to, jobs or 1, file_types,
+               pattern, progress)
     else:
-        cleanup(abs_path, dry_run, silent)
+        cleanup(abs_path, dry_run, silent, sniff, jobs or 1, resume, store,
+                progress)
 
 
 if __name__ == '__main__':
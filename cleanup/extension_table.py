@@ -0,0 +1,307 @@
+#! /usr/bin/env python3
+
+'''
+A compiled, memory-mapped form of the FILE_TYPES table.
+
+The table is built from file_types.py by running this module:
+  python3 -m cleanup.extension_table
+
+It holds the known extensions in sorted order along with small-int category
+ids, followed by the trie used by get_longest_extension. Nothing is read until
+the first lookup, and the trie is only decoded as far as lookups reach.
+'''
+
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from collections.abc import Mapping
+
+TABLE_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                          'file_types.bin')
+
+MAGIC = b'CUFT'
+VERSION = 1
+
+# magic, version, number of categories, extensions and trie edges
+HEADER = struct.Struct('<4sHHII')
+
+
+def build_trie(extensions):
+    '''
+    Returns the nodes of a trie of the given extensions keyed by their
+    dot-separated parts, last part first. Each node is a dict mapping a part to
+    a (child node index, index of the extension completed by the part or -1)
+    pair, and the root is node 0.
+    '''
+    nodes = [{}]
+    for index, extension in enumerate(extensions):
+        node = nodes[0]
+        parts = list(reversed(extension.split('.')))
+        for depth, part in enumerate(parts):
+            child, key = node.get(part, (None, -1))
+            if child is None:
+                child = len(nodes)
+                nodes.append({})
+            if depth == len(parts) - 1:
+                key = index
+            node[part] = (child, key)
+            node = nodes[child]
+    return nodes
+
+
+def compile_table(file_types):
+    '''
+    Returns the binary form of the given extension to file type mapping.
+    '''
+    extensions = sorted(file_types, key=lambda extension: extension.encode())
+    categories = sorted(set(file_types.values()))
+    category_ids = {category: i for i, category in enumerate(categories)}
+    nodes = build_trie(extensions)
+
+    key_offsets = array('I', [0])
+    key_blob = bytearray()
+    for extension in extensions:
+        key_blob += extension.encode()
+        key_offsets.append(len(key_blob))
+    key_categories = array('B', [category_ids[file_types[extension]]
+                                 for extension in extensions])
+
+    # the edges of every node are stored contiguously, sorted by label
+    node_edges = array('I', [0])
+    label_offsets = array('I', [0])
+    label_blob = bytearray()
+    edge_children = array('I')
+    edge_keys = array('i')
+    for node in nodes:
+        for part in sorted(node, key=lambda part: part.encode()):
+            child, key = node[part]
+            label_blob += part.encode()
+            label_offsets.append(len(label_blob))
+            edge_children.append(child)
+            edge_keys.append(key)
+        node_edges.append(len(edge_children))
+
+    sections = [HEADER.pack(MAGIC, VERSION, len(categories), len(extensions),
+                            len(edge_children))]
+    for category in categories:
+        name = category.encode()
+        sections.append(struct.pack('<B', len(name)) + name)
+    for section in (key_offsets, key_categories, node_edges, label_offsets,
+                    edge_children, edge_keys):
+        if sys.byteorder != 'little':
+            section.byteswap()
+        sections.append(section.tobytes())
+    sections.append(bytes(key_blob))
+    sections.append(bytes(label_blob))
+    return b''.join(sections)
+
+
+def write_table(file_types, path=TABLE_FILE):
+    with open(path, 'wb') as file:
+        file.write(compile_table(file_types))
+
+
+class TrieRoot(dict):
+    '''
+    The root of the extension trie, which decodes the subtree under a part from
+    the table the first time that part is looked up. Looking up a part that is
+    not the last part of any extension returns None, and up to MAX_MISSES such
+    parts are remembered so that repeated lookups skip the table.
+    '''
+    __slots__ = ('table', 'misses')
+
+    MAX_MISSES = 65536
+
+    def __init__(self, table):
+        super().__init__()
+        self.table = table
+        self.misses = 0
+
+    def __missing__(self, part):
+        child = self.table.find_child(0, part)
+        if child is not None or self.misses < self.MAX_MISSES:
+            self[part] = child
+            self.misses += child is None
+        return child
+
+
+class ExtensionTable(Mapping):
+    '''
+    A read-only mapping from an extension to its file type, backed by a table
+    file that is memory-mapped on the first lookup.
+    '''
+
+    def __init__(self, path=TABLE_FILE):
+        self.path = path
+        self._categories = None
+        self._map = None
+        self._root = None
+        # held while loading, which several threads may start at once
+        self._lock = threading.Lock()
+        # extensions already looked up, either directly or through the trie
+        self._found = {}
+
+    def _column(self, mapped, offset, typecode, length):
+        size = array(typecode).itemsize * length
+        view = memoryview(mapped)[offset:offset + size]
+        if sys.byteorder == 'little':
+            return view.cast(typecode), offset + size
+        column = array(typecode, view)
+        column.byteswap()
+        return column, offset + size
+
+    def _ensure_loaded(self):
+        '''
+        Loads the table unless it has been. The map is set last, once every
+        column is, so that a thread that finds it set can use the table.
+        '''
+        if self._map is None:
+            with self._lock:
+                if self._map is None:
+                    self._load()
+
+    def _load(self):
+        with open(self.path, 'rb') as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n_categories, n_keys, n_edges = \
+            HEADER.unpack_from(mapped)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Unsupported extension table: ' + self.path)
+        offset = HEADER.size
+        categories = []
+        for _ in range(n_categories):
+            length = mapped[offset]
+            categories.append(mapped[offset + 1:offset + 1 + length].decode())
+            offset += 1 + length
+        self._key_offsets, offset = self._column(mapped, offset, 'I',
+                                                 n_keys + 1)
+        self._key_categories, offset = self._column(mapped, offset, 'B',
+                                                    n_keys)
+        self._node_edges, offset = self._column(mapped, offset, 'I',
+                                                n_edges + 2)
+        self._label_offsets, offset = self._column(mapped, offset, 'I',
+                                                   n_edges + 1)
+        self._edge_children, offset = self._column(mapped, offset, 'I',
+                                                   n_edges)
+        self._edge_keys, offset = self._column(mapped, offset, 'i', n_edges)
+        self._key_blob = offset
+        self._label_blob = offset + self._key_offsets[n_keys]
+        self._length = n_keys
+        self._categories = categories
+        self._map = mapped
+
+    def _key(self, index):
+        start = self._key_blob + self._key_offsets[index]
+        end = self._key_blob + self._key_offsets[index + 1]
+        return self._map[start:end]
+
+    def _label(self, edge):
+        start = self._label_blob + self._label_offsets[edge]
+        end = self._label_blob + self._label_offsets[edge + 1]
+        return self._map[start:end]
+
+    def _subtree(self, edge):
+        '''
+        Returns the node reached through the given edge as a dict mapping each
+        part to the next node. A node that completes an extension stores it
+        under the key '.', which can never be a part.
+        '''
+        node = {}
+        key = self._edge_keys[edge]
+        if key >= 0:
+            extension = self._key(key).decode()
+            self._found[extension] = \
+                self._categories[self._key_categories[key]]
+            node['.'] = extension
+        index = self._edge_children[edge]
+        for child in range(self._node_edges[index],
+                           self._node_edges[index + 1]):
+            node[self._label(child).decode()] = self._subtree(child)
+        return node
+
+    def find_child(self, index, part):
+        '''
+        Returns the subtree under the given trie node reached through the given
+        part, or None if there isn't one.
+        '''
+        try:
+            label = part.encode('ascii')
+        except UnicodeEncodeError:
+            return None
+        low = self._node_edges[index]
+        end = high = self._node_edges[index + 1]
+        while low < high:
+            middle = (low + high) // 2
+            if self._label(middle) < label:
+                low = middle + 1
+            else:
+                high = middle
+        if low == end or self._label(low) != label:
+            return None
+        return self._subtree(low)
+
+    @property
+    def categories(self):
+        '''
+        The sorted names of the file types.
+        '''
+        self._ensure_loaded()
+        return self._categories
+
+    @property
+    def trie(self):
+        '''
+        The root node of the extension trie.
+        '''
+        if self._root is None:
+            self._ensure_loaded()
+            self._root = TrieRoot(self)
+        return self._root
+
+    def __getitem__(self, extension):
+        category = self._found.get(extension)
+        if category is not None:
+            return category
+        self._ensure_loaded()
+        try:
+            key = extension.encode('ascii')
+        except (AttributeError, UnicodeEncodeError):
+            raise KeyError(extension)
+        low, high = 0, self._length
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self._length or self._key(low) != key:
+            raise KeyError(extension)
+        category = self._categories[self._key_categories[low]]
+        self._found[extension] = category
+        return category
+
+    def __iter__(self):
+        self._ensure_loaded()
+        for index in range(self._length):
+            yield self._key(index).decode()
+
+    def __len__(self):
+        self._ensure_loaded()
+        return self._length
+
+
+FILE_TYPES = ExtensionTable()
+
+
+def main():
+    from .file_types import FILE_TYPES as SOURCE_FILE_TYPES
+    write_table(SOURCE_FILE_TYPES)
+    print('Wrote ' + str(len(SOURCE_FILE_TYPES)) + ' extensions to '
+          + TABLE_FILE)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,8 @@
 '''
 A dictionary that maps a file extension to its type.
+
+It is compiled into file_types.bin, which is what cleanup reads at run time.
+See extension_table.py.
 '''
 
 FILE_TYPES = {
@@ -620,6 +623,7 @@ FILE_TYPES = {
     "AVHD": "Disk image",
     "AVHDX": "Data",
     "AVI": "Video",
+    "AVIF": "Raster image",
     "AVJ": "Data",
     "AVL": "GIS",
     "AVM": "Video",
@@ -1385,6 +1389,7 @@ FILE_TYPES = {
     "CPX": "Settings",
     "CPY": "Page layout",
     "CR2": "Raw camera image",
+    "CR3": "Raw camera image",
     "CRAFT": "Game file",
     "CRAM": "Data",
     "CRASH": "System",
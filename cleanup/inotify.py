@@ -0,0 +1,91 @@
+'''
+A minimal binding to the Linux inotify API through ctypes.
+'''
+
+import ctypes
+import os
+import select
+import struct
+import sys
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+# wd, mask, cookie and name length, followed by the name padded with NULs
+EVENT = struct.Struct('iIII')
+
+# large enough for a few hundred events with long names
+READ_SIZE = 64 * 1024
+
+
+def load_libc():
+    '''
+    Returns the C library if it provides inotify, or None otherwise.
+    '''
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                       ctypes.c_uint32]
+    return libc
+
+
+class Inotify:
+    '''
+    An inotify instance watching a single directory.
+    '''
+
+    def __init__(self, path, mask):
+        libc = load_libc()
+        if libc is None:
+            raise OSError('inotify is not available on this system')
+        self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        if libc.inotify_add_watch(self.fd, os.fsencode(path),
+                                  mask | IN_ONLYDIR) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, os.strerror(error), path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def read(self, timeout=None):
+        '''
+        Returns the (mask, name) pairs of the events that arrive within the
+        given number of seconds, waiting for as long as it takes if it is None.
+        The list is empty if no event arrived in time.
+        '''
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        data = os.read(self.fd, READ_SIZE)
+        events = []
+        offset = 0
+        while offset < len(data):
+            _, mask, _, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append((mask, os.fsdecode(name)))
+        return events
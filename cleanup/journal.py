@@ -0,0 +1,772 @@
+'''
+The information needed to revert cleanups, kept in a store with one small
+journal per cleaned directory, named after a hash of the directory's absolute
+path. Reverting a directory reads only its own journal, and cleanups of
+different directories never write to the same file.
+
+A journal holds records in the compact format of the records module, each of
+which lists files that were moved by a cleanup of the directory, or by a watch
+if its header is marked to extend the records before it. Every cleanup adds a
+record, numbered as the next generation of the directory, and holding only the
+files that it moved. The files moved by a watch are added to the latest
+generation. A revert removes the records of the generations it reverts, or
+rewrites them without the moves it reverts if it only reverts some.
+
+Next to each journal is an index of the offsets at which its generations
+start, so that reading the latest generations, and finding the latest one,
+skips the records of the ones before them. The index is only ever a shortcut:
+an entry is checked against the journal before it is used, and reading falls
+back to the start of the journal without one.
+
+While a cleanup is running, the moves it is about to make are also written
+ahead to a log next to the journal, so that a cleanup that is interrupted can
+be resumed or rolled back. The log is removed once the cleanup is recorded in
+the journal.
+
+Several processes can use the store at once. Changes to the files of a
+directory, and the creation and removal of its log, are made under a lock on
+a lock file, which is never removed or replaced, so that none of the files
+that are changed has to be held open while it is removed or replaced, which
+Windows refuses. Directories whose names start alike share a lock file, so
+that there are only ever a fixed number of them, however many directories
+are cleaned up. Reading a journal needs no lock: records are
+only appended to it, or cut off its end, or the journal is replaced whole
+through a rename, and a record that is cut short while it is being read lists
+fewer files than its header counts, and is left out. A log is kept locked for
+as long as its cleanup is running, which tells a running cleanup from an
+interrupted one.
+'''
+
+import hashlib
+import io
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:     # Windows
+    fcntl = None
+    import msvcrt
+
+from .records import (encode_record, file_stamps, flatten, group_files,
+                      iter_records)
+
+PACKAGE_DIR = os.path.dirname(os.path.realpath(__file__))
+
+STORE_DIR = os.path.join(PACKAGE_DIR, 'revert_info')
+
+# moves written ahead, and synced to disk, at a time
+WAL_BATCH = 1024
+
+# where revert info was kept, in a single journal and before that in a single
+# JSON document, by earlier versions
+LEGACY_JOURNAL_FILE = os.path.join(PACKAGE_DIR, 'revert_info.jsonl')
+LEGACY_REVERT_INFO_FILE = os.path.join(PACKAGE_DIR, 'revert_info.json')
+
+# journals of single directories kept as JSON lines by earlier versions end
+# with this, where journals now end with JOURNAL_SUFFIX
+LEGACY_SUFFIX = '.jsonl'
+JOURNAL_SUFFIX = '.journal'
+INDEX_SUFFIX = '.index'
+LOCK_SUFFIX = '.lock'
+
+# characters of the name of a directory's files that name its lock file, of
+# which there are then at most 16 to the power of this
+LOCK_KEY_LENGTH = 2
+
+# bytes read from the end of a journal to find where its last line ends
+BLOCK_SIZE = 64 * 1024
+
+# locked while moving legacy revert info into the store
+MIGRATION_LOCK_FILE = 'migration.lock'
+
+# seconds between attempts to take a lock where locks can't be waited for
+LOCK_RETRY = 0.05
+
+
+def path_key(abs_path):
+    '''
+    Returns a name for files that belong to the given directory.
+    '''
+    return hashlib.sha1(os.fsencode(abs_path)).hexdigest()
+
+
+def journal_file(abs_path):
+    return os.path.join(STORE_DIR, path_key(abs_path) + JOURNAL_SUFFIX)
+
+
+def index_file(abs_path):
+    return os.path.join(STORE_DIR, path_key(abs_path) + INDEX_SUFFIX)
+
+
+def wal_file(abs_path):
+    return os.path.join(STORE_DIR, path_key(abs_path) + '.wal')
+
+
+def lock_file(abs_path):
+    return os.path.join(STORE_DIR,
+                        path_key(abs_path)[:LOCK_KEY_LENGTH] + LOCK_SUFFIX)
+
+
+def legacy_lock_file(abs_path):
+    '''
+    Returns the lock file that earlier versions kept for the given directory
+    alone.
+    '''
+    return os.path.join(STORE_DIR, path_key(abs_path) + LOCK_SUFFIX)
+
+
+def iter_json_records(file):
+    for line in file:
+        # a line cut short by an interruption was never fully written, and so
+        # belongs to a watch batch that was never recorded
+        if line.endswith(b'\n'):
+            yield json.loads(line)
+
+
+def replay(records):
+    '''
+    Returns the revert info dict that the given JSON records, in order, amount
+    to.
+    '''
+    revert_info = {}
+    for record in records:
+        abs_path = record['path']
+        if record['files'] is None:
+            revert_info.pop(abs_path, None)
+        elif record.get('extend'):
+            revert_info.setdefault(abs_path, []).extend(record['files'])
+        else:
+            revert_info[abs_path] = record['files']
+    return revert_info
+
+
+def sync(file):
+    file.flush()
+    os.fsync(file.fileno())
+
+
+def sync_dir(path):
+    '''
+    Makes the creation or removal of files in the given directory durable,
+    where the platform allows directories to be opened.
+    '''
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def lock(file, blocking=True):
+    '''
+    Takes an exclusive lock on the given open file, until it is unlocked or
+    closed. Returns False if blocking is not set and another open file holds
+    the lock. On Windows, the lock covers the first byte of the file, and is
+    waited for by trying again every LOCK_RETRY.
+    '''
+    if fcntl is not None:
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.flock(file.fileno(), flags)
+        except BlockingIOError:
+            return False
+        return True
+    while True:
+        file.seek(0)
+        try:
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            if not blocking:
+                return False
+        time.sleep(LOCK_RETRY)
+
+
+def unlock(file):
+    if fcntl is not None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+    else:
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def locked(path):
+    '''
+    Holds a lock on the given lock file, created along with the store if
+    needed, for the duration of a with statement.
+    '''
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with io.open(path, 'ab') as file:
+        lock(file)
+        try:
+            yield
+        finally:
+            unlock(file)
+
+
+def record_generation(header, last):
+    '''
+    Returns the generation of the record with the given header, following a
+    record of the given generation, or of 0 at the start of the journal.
+    Records written before generations were numbered count as the next one.
+    '''
+    if header.get('extend'):
+        return max(last, 1)
+    return header.get('generation', last + 1)
+
+
+def read_index(abs_path):
+    '''
+    Returns the (generation, offset) entries in the index of the journal of
+    the given directory.
+    '''
+    try:
+        with io.open(index_file(abs_path), 'rb') as file:
+            lines = file.read().split(b'\n')
+    except FileNotFoundError:
+        return []
+    # the last piece is empty, or an entry cut short
+    return [tuple(map(int, line.split())) for line in lines[:-1]]
+
+
+def write_index(abs_path, entries, mode='ab'):
+    with io.open(index_file(abs_path), mode) as file:
+        file.writelines(b'%d %d\n' % entry for entry in entries)
+
+
+def start_offset(abs_path, journal, generation):
+    '''
+    Returns an offset in the given journal of the directory from which reading
+    finds every generation from the given one on. That is where the latest
+    indexed generation up to the given one starts, if the journal confirms it,
+    and the start of the journal otherwise.
+    '''
+    for indexed, offset in reversed(read_index(abs_path)):
+        if indexed <= generation:
+            journal.seek(offset)
+            line = journal.readline()
+            if line[:1] == b'{' and line.endswith(b'\n'):
+                header = json.loads(line)
+                if not header.get('extend') and \
+                        header.get('generation') == indexed:
+                    return offset
+            break
+    return 0
+
+
+def iter_headers(journal, offset):
+    '''
+    Yields the offset and generation of each record of the given journal from
+    the record at the given offset on, reading only as far as their headers.
+    '''
+    journal.seek(offset)
+    last = 0
+    for line in journal:
+        if line[:1] == b'{' and line.endswith(b'\n'):
+            last = record_generation(json.loads(line), last)
+            yield offset, last
+        offset += len(line)
+
+
+def find_last_generation(abs_path, journal):
+    journal.seek(start_offset(abs_path, journal, float('inf')))
+    last = 0
+    for header, groups in iter_records(journal):
+        last = record_generation(header, last)
+    return last
+
+
+def iter_generations(file, file_types=None):
+    '''
+    Yields a (generation, time, groups) tuple for each generation recorded in
+    the given journal, with the groups of the records that extend it added,
+    keeping only the groups of the given file types if any are given. The
+    time of a generation that a watch started is that of the first of its
+    records with one, so it is None only for generations recorded before
+    times were.
+    '''
+    current = None
+    last = 0
+    for header, groups in iter_records(file, file_types):
+        generation = record_generation(header, last)
+        if current is not None and generation == current[0]:
+            current[2].extend(groups)
+            if current[1] is None and started_by_watch:
+                current[1] = header.get('time')
+        else:
+            started_by_watch = bool(header.get('extend'))
+            if current is not None:
+                yield tuple(current)
+            current = [generation, header.get('time'), list(groups)]
+        last = generation
+    if current is not None:
+        yield tuple(current)
+
+
+def discard_torn_line(file, path):
+    '''
+    Truncates the given journal, opened for appending from the given path,
+    after its last complete line, so that a record appended after one cut
+    short can't run into it.
+    '''
+    size = end = file.seek(0, os.SEEK_END)
+    with io.open(path, 'rb') as journal:
+        while end > 0:
+            start = max(0, end - BLOCK_SIZE)
+            journal.seek(start)
+            block = journal.read(end - start)
+            if end == size and block.endswith(b'\n'):
+                return
+            newline = block.rfind(b'\n')
+            if newline >= 0:
+                file.truncate(start + newline + 1)
+                return
+            end = start
+    file.truncate(0)
+
+
+def rewrite_journal(abs_path, rewrite, index=None):
+    '''
+    Replaces the journal of the given directory with the lines that the given
+    function returns for its lines, written to a temporary file that is
+    renamed over the journal under the lock of the directory. The index is
+    replaced with the given entries, if any, under the same lock, once the
+    lines have been written.
+    '''
+    os.makedirs(STORE_DIR, exist_ok=True)
+    path = journal_file(abs_path)
+    with locked(lock_file(abs_path)):
+        fd, temp_file = tempfile.mkstemp(suffix='.tmp', dir=STORE_DIR)
+        try:
+            with io.open(fd, 'wb') as file:
+                try:
+                    journal = io.open(path, 'rb')
+                except FileNotFoundError:
+                    journal = io.BytesIO()
+                with journal:
+                    file.writelines(rewrite(journal))
+                sync(file)
+            os.replace(temp_file, path)
+        except BaseException:
+            try:
+                os.remove(temp_file)
+            except FileNotFoundError:
+                pass
+            raise
+        if index is not None:
+            write_index(abs_path, index, 'wb')
+
+
+def write_journal(abs_path, files):
+    '''
+    Replaces the journal of the given directory with one that holds the given
+    files as its first generation.
+    '''
+    rewrite_journal(abs_path, lambda journal: encode_record(
+        {'path': abs_path, 'generation': 1}, group_files(files),
+        file_stamps(files)))
+
+
+def migrate_legacy_files(legacy_files):
+    '''
+    Moves the revert info kept as JSON, in the given files, by earlier versions
+    into the store.
+    '''
+    os.makedirs(STORE_DIR, exist_ok=True)
+    with locked(os.path.join(STORE_DIR, MIGRATION_LOCK_FILE)):
+        revert_info = {}
+        for legacy_file in legacy_files:
+            try:
+                file = io.open(legacy_file, 'rb')
+            except FileNotFoundError:
+                continue
+            with file:
+                if legacy_file == LEGACY_REVERT_INFO_FILE:
+                    revert_info.update(json.load(file))
+                    continue
+                if legacy_file == LEGACY_JOURNAL_FILE:
+                    file.readline()     # the header
+                revert_info.update(replay(iter_json_records(file)))
+        for abs_path, files in revert_info.items():
+            # a directory cleaned up since is already in the store
+            if not os.path.exists(journal_file(abs_path)):
+                write_journal(abs_path, files)
+        for legacy_file in legacy_files:
+            try:
+                os.remove(legacy_file)
+            except FileNotFoundError:
+                pass
+
+
+def migrate_legacy_revert_info(abs_path=None):
+    '''
+    Moves the revert info kept by earlier versions, in a single file or in a
+    JSON lines journal of the given directory, into the store.
+    '''
+    legacy_files = [LEGACY_REVERT_INFO_FILE, LEGACY_JOURNAL_FILE]
+    if abs_path is not None:
+        legacy_files.append(os.path.join(STORE_DIR,
+                                         path_key(abs_path) + LEGACY_SUFFIX))
+    legacy_files = [legacy_file for legacy_file in legacy_files
+                    if os.path.exists(legacy_file)]
+    if legacy_files:
+        migrate_legacy_files(legacy_files)
+
+
+def append_revert_list(abs_path, revert_list, extend=False):
+    '''
+    Records the given revert list for the given directory as its next
+    generation, or adds it to the latest generation if extend is set. Forgets
+    about the directory if the list is None.
+    '''
+    migrate_legacy_revert_info(abs_path)
+    if revert_list is None:
+        drop_generations(abs_path, 0)
+        return
+    os.makedirs(STORE_DIR, exist_ok=True)
+    path = journal_file(abs_path)
+    with locked(lock_file(abs_path)), io.open(path, 'ab') as file:
+        discard_torn_line(file, path)
+        header = {'path': abs_path, 'time': int(time.time())}
+        if extend:
+            header['extend'] = True
+            file.writelines(encode_record(header, group_files(revert_list),
+                                          file_stamps(revert_list)))
+            sync(file)
+            return
+        with io.open(path, 'rb') as journal:
+            generation = find_last_generation(abs_path, journal) + 1
+        header['generation'] = generation
+        offset = file.seek(0, os.SEEK_END)
+        file.writelines(encode_record(header, group_files(revert_list),
+                                      file_stamps(revert_list)))
+        sync(file)
+        write_index(abs_path, [(generation, offset)])
+
+
+def drop_generations(abs_path, generation, selected=None):
+    '''
+    Forgets about the generations of the given directory after the given one,
+    or about the directory if it is 0. If a function is given, only the moves
+    of those generations that it selects, by name and file type, are
+    forgotten.
+    '''
+    migrate_legacy_revert_info(abs_path)
+    path = journal_file(abs_path)
+    if not os.path.exists(path):
+        return
+    if selected is not None:
+        drop_moves(abs_path, generation, selected)
+        return
+    with locked(lock_file(abs_path)):
+        if generation <= 0:
+            for file in (path, index_file(abs_path),
+                         legacy_lock_file(abs_path)):
+                try:
+                    os.remove(file)
+                except FileNotFoundError:
+                    pass
+            return
+        # the records of a generation come after those of the ones before
+        # it, so the journal is cut short where the next one starts
+        try:
+            journal = io.open(path, 'r+b')
+        except FileNotFoundError:
+            return
+        with journal:
+            offset = start_offset(abs_path, journal, generation + 1)
+            cut = next((offset for offset, found
+                        in iter_headers(journal, offset)
+                        if found > generation), None)
+            if cut is None:
+                return
+            journal.truncate(cut)
+            sync(journal)
+        write_index(abs_path, [entry for entry in read_index(abs_path)
+                               if entry[1] < cut], 'wb')
+
+
+def drop_moves(abs_path, generation, selected):
+    '''
+    Rewrites the generations of the journal of the given directory after the
+    given one without the moves that the given function selects, by name and
+    file type, each as a single record. Generations left without moves are
+    dropped.
+    '''
+    if last_generation(abs_path) <= generation:
+        return
+    index = []
+
+    def rewrite(journal):
+        offset = start_offset(abs_path, journal, generation + 1)
+        cut = next((offset for offset, found in iter_headers(journal, offset)
+                    if found > generation), None)
+        journal.seek(0)
+        if cut is None:
+            index.extend(read_index(abs_path))
+            yield from journal
+            return
+        left = cut
+        while left:
+            block = journal.read(min(left, BLOCK_SIZE))
+            left -= len(block)
+            yield block
+        index.extend(entry for entry in read_index(abs_path)
+                     if entry[1] < cut)
+        offset = cut
+        for found, run_time, groups in iter_generations(journal):
+            kept = {}
+            stamps = {}
+            for file_type, names, group_stamps in groups:
+                for name, stamp in zip(names, group_stamps):
+                    if not selected(name, file_type):
+                        kept.setdefault(file_type, []).append(name)
+                        if stamp is not None:
+                            stamps[name] = stamp
+            if not kept:
+                continue
+            header = {'path': abs_path, 'generation': found}
+            if run_time is not None:
+                header['time'] = run_time
+            index.append((found, offset))
+            for line in encode_record(header, kept, stamps):
+                offset += len(line)
+                yield line
+
+    rewrite_journal(abs_path, rewrite, index)
+
+
+def read_generations(abs_path, after=0, file_types=None):
+    '''
+    Returns a (generation, time, revert list) tuple for each generation
+    recorded for the given directory after the given one, oldest first, where
+    time is None for generations recorded before times were. The records of
+    earlier generations are skipped without being read, and only the moves of
+    the given file types are returned if any are given.
+    '''
+    migrate_legacy_revert_info(abs_path)
+    try:
+        file = io.open(journal_file(abs_path), 'rb')
+    except FileNotFoundError:
+        return []
+    with file:
+        file.seek(start_offset(abs_path, file, after + 1))
+        return [(generation, run_time, flatten(groups))
+                for generation, run_time, groups
+                in iter_generations(file, file_types)
+                if generation > after]
+
+
+def last_generation(abs_path):
+    '''
+    Returns the latest generation recorded for the given directory, or 0 if
+    there isn't one.
+    '''
+    migrate_legacy_revert_info(abs_path)
+    try:
+        file = io.open(journal_file(abs_path), 'rb')
+    except FileNotFoundError:
+        return 0
+    with file:
+        return find_last_generation(abs_path, file)
+
+
+def read_revert_groups(abs_path):
+    '''
+    Returns the (file type, names, stamps) groups of the files recorded for
+    the given directory, streamed from its journal, or None if there isn't
+    one. Groups of a type recur once for every record that moved files of
+    that type.
+    '''
+    migrate_legacy_revert_info(abs_path)
+    try:
+        file = io.open(journal_file(abs_path), 'rb')
+    except FileNotFoundError:
+        return None
+    with file:
+        return [group for header, groups in iter_records(file)
+                for group in groups]
+
+
+def read_revert_list(abs_path):
+    '''
+    Returns the revert list recorded for the given directory, or None if there
+    isn't one.
+    '''
+    groups = read_revert_groups(abs_path)
+    return None if groups is None else flatten(groups)
+
+
+def read_revert_info():
+    '''
+    Returns the revert lists of all the directories in the store, keyed by the
+    absolute paths of the directories.
+    '''
+    migrate_legacy_revert_info()
+    try:
+        names = os.listdir(STORE_DIR)
+    except FileNotFoundError:
+        return {}
+    legacy_files = [os.path.join(STORE_DIR, name) for name in names
+                    if name.endswith(LEGACY_SUFFIX)]
+    if legacy_files:
+        migrate_legacy_files(legacy_files)
+        names = os.listdir(STORE_DIR)
+    revert_info = {}
+    for name in sorted(names):
+        if name.endswith(JOURNAL_SUFFIX):
+            with io.open(os.path.join(STORE_DIR, name), 'rb') as file:
+                for header, groups in iter_records(file):
+                    revert_info.setdefault(header['path'], []) \
+                        .extend(flatten(groups))
+    return revert_info
+
+
+def is_interrupted(abs_path):
+    '''
+    Returns whether a cleanup of the given directory was interrupted, and so
+    left its write-ahead log behind, rather than still running.
+    '''
+    if not os.path.exists(wal_file(abs_path)):
+        # so that looking doesn't leave a lock file behind
+        return False
+    with locked(lock_file(abs_path)):
+        try:
+            file = io.open(wal_file(abs_path), 'rb')
+        except FileNotFoundError:
+            return False
+        with file:
+            if not lock(file, blocking=False):
+                return False
+            unlock(file)
+            return True
+
+
+class WriteAheadLog:
+    '''
+    The log of the moves that a cleanup of a directory is about to make. Moves
+    are written in batches, with one sync to disk per batch, before any of
+    them is made. The first line of the log is a header naming the directory
+    and telling whether the cleanup extends the one already recorded, and
+    every other line is a move. Creating a log while another cleanup of the
+    directory has one raises FileExistsError.
+    '''
+
+    def __init__(self, abs_path, extend=False, file=None, moves=()):
+        self.abs_path = abs_path
+        self.extend = extend
+        # the moves logged before the cleanup was interrupted, if it was
+        self.moves = list(moves)
+        if file is None:
+            file = self.create(abs_path, extend)
+        self.file = file
+
+    @staticmethod
+    def create(abs_path, extend):
+        '''
+        Creates a log with its header, and locks it, under the lock of the
+        directory, so that it is never seen unlocked or without a header.
+        '''
+        os.makedirs(STORE_DIR, exist_ok=True)
+        path = wal_file(abs_path)
+        with locked(lock_file(abs_path)):
+            file = io.open(path, 'xb')
+            try:
+                lock(file)
+                file.write((json.dumps({'path': abs_path, 'extend': extend})
+                            + '\n').encode())
+                sync(file)
+            except BaseException:
+                file.close()
+                os.remove(path)
+                raise
+        sync_dir(STORE_DIR)
+        return file
+
+    @classmethod
+    def open_interrupted(cls, abs_path):
+        '''
+        Returns the log left behind by an interrupted cleanup of the given
+        directory, opened for logging more moves, or None if there isn't one
+        or the cleanup is still running.
+        '''
+        if not os.path.exists(wal_file(abs_path)):
+            return None
+        with locked(lock_file(abs_path)):
+            try:
+                file = io.open(wal_file(abs_path), 'r+b')
+            except FileNotFoundError:
+                return None
+            if not lock(file, blocking=False):
+                file.close()
+                return None
+        header = json.loads(file.readline())
+        moves = []
+        for line in file:
+            # a line cut short by the interruption belongs to a batch that was
+            # never synced, so none of its moves were made
+            if line.endswith(b'\n'):
+                move = json.loads(line)
+                moves.append((move['name'], move['type']))
+        file.seek(0, os.SEEK_END)
+        return cls(abs_path, header['extend'], file, moves)
+
+    def write_ahead(self, moves):
+        '''
+        Passes through the given (name, file type) moves, logging each batch of
+        WAL_BATCH of them before the first of the batch is passed on.
+        '''
+        batch = []
+        for move in moves:
+            batch.append(move)
+            if len(batch) == WAL_BATCH:
+                self.log(batch)
+                yield from batch
+                batch = []
+        if batch:
+            self.log(batch)
+            yield from batch
+
+    def log(self, moves):
+        self.file.write(b''.join(
+            (json.dumps({'name': name, 'type': file_type}) + '\n').encode()
+            for name, file_type in moves))
+        sync(self.file)
+
+    def close(self):
+        if not self.file.closed:
+            unlock(self.file)
+            self.file.close()
+
+    def remove(self):
+        '''
+        Closes and removes the log, once the cleanup it belongs to has been
+        recorded or rolled back, under the lock of the directory, so that it
+        is never seen unlocked before it is removed.
+        '''
+        with locked(lock_file(self.abs_path)):
+            self.close()
+            os.remove(wal_file(self.abs_path))
+        sync_dir(STORE_DIR)
+
+    def commit(self, revert_list, store=None):
+        '''
+        Records the given revert list of the cleanup in the given store, or in
+        the journal of the directory by default, unless it is empty, and then
+        removes the log.
+        '''
+        if revert_list:
+            append = append_revert_list if store is None \
+                else store.append_revert_list
+            append(self.abs_path, revert_list, self.extend)
+        self.remove()
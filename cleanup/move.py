@@ -0,0 +1,235 @@
+'''
+Move files between a directory and the category subdirectories inside it.
+'''
+
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# calls queued per thread by run_ordered
+QUEUED_PER_JOB = 4
+
+O_DIRECTORY = os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0)
+
+# whether files can be renamed relative to open directories, which is the case
+# on Unix but not on Windows
+DIR_FD_SUPPORTED = (os.rename in os.supports_dir_fd
+                    and os.open in os.supports_dir_fd
+                    and os.mkdir in os.supports_dir_fd
+                    and os.rmdir in os.supports_dir_fd
+                    and os.scandir in os.supports_fd)
+
+
+class Mover:
+    '''
+    Moves files between a directory and its category subdirectories with a
+    single rename each. A category subdirectory is created the first time a
+    file is moved into it, unless it is among the subdirectories already known
+    to exist.
+    '''
+
+    def __init__(self, root_dir, dirs=()):
+        self.root_dir = root_dir
+        self.dirs = set(dirs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        pass
+
+    def scandir(self):
+        return os.scandir(self.root_dir)
+
+    def listdir(self, file_type):
+        return os.listdir(os.path.join(self.root_dir, file_type))
+
+    def stat(self, name, file_type):
+        return os.stat(os.path.join(self.root_dir, file_type, name),
+                       follow_symlinks=False)
+
+    def provision(self, file_type):
+        # safe to race from several threads, as makedirs tolerates the
+        # directory having been created in the meantime
+        if file_type not in self.dirs:
+            os.makedirs(os.path.join(self.root_dir, file_type), exist_ok=True)
+            self.dirs.add(file_type)
+
+    def move(self, name, file_type):
+        self.provision(file_type)
+        os.rename(os.path.join(self.root_dir, name),
+                  os.path.join(self.root_dir, file_type, name))
+
+    def move_back(self, name, file_type):
+        os.rename(os.path.join(self.root_dir, file_type, name),
+                  os.path.join(self.root_dir, name))
+
+    def prune(self, file_types):
+        '''
+        Removes those of the given category subdirectories that are empty.
+        '''
+        for file_type in file_types:
+            try:
+                os.rmdir(os.path.join(self.root_dir, file_type))
+            except OSError:
+                pass
+
+
+class FdMover(Mover):
+    '''
+    A Mover that keeps the directory and each category subdirectory open and
+    renames files relative to them, so that the kernel doesn't resolve the
+    full path of every file twice. Files keep moving within the same directory
+    even if it is renamed partway through.
+    '''
+
+    def __init__(self, root_dir, dirs=()):
+        super().__init__(root_dir, dirs)
+        self.root_fd = os.open(root_dir, O_DIRECTORY)
+        self.fds = {}
+        self.lock = threading.Lock()
+
+    def close(self):
+        for fd in self.fds.values():
+            os.close(fd)
+        self.fds.clear()
+        if self.root_fd is not None:
+            os.close(self.root_fd)
+            self.root_fd = None
+
+    def scandir(self):
+        return os.scandir(self.root_fd)
+
+    def listdir(self, file_type):
+        return os.listdir(self.open_dir(file_type))
+
+    def stat(self, name, file_type):
+        return os.stat(name, dir_fd=self.open_dir(file_type),
+                       follow_symlinks=False)
+
+    def open_dir(self, file_type, create=False):
+        '''
+        Returns a descriptor for the given category subdirectory, opening it
+        the first time, after creating it if needed when create is set.
+        '''
+        fd = self.fds.get(file_type)
+        if fd is not None:
+            return fd
+        with self.lock:
+            fd = self.fds.get(file_type)
+            if fd is None:
+                if create and file_type not in self.dirs:
+                    try:
+                        os.mkdir(file_type, dir_fd=self.root_fd)
+                    except FileExistsError:
+                        pass
+                    self.dirs.add(file_type)
+                fd = os.open(file_type, O_DIRECTORY, dir_fd=self.root_fd)
+                self.fds[file_type] = fd
+        return fd
+
+    def move(self, name, file_type):
+        os.rename(name, name, src_dir_fd=self.root_fd,
+                  dst_dir_fd=self.open_dir(file_type, create=True))
+
+    def move_back(self, name, file_type):
+        os.rename(name, name, src_dir_fd=self.open_dir(file_type),
+                  dst_dir_fd=self.root_fd)
+
+    def prune(self, file_types):
+        for file_type in file_types:
+            fd = self.fds.pop(file_type, None)
+            if fd is not None:
+                os.close(fd)
+            try:
+                os.rmdir(file_type, dir_fd=self.root_fd)
+            except OSError:
+                pass
+
+
+def open_mover(root_dir, dirs=()):
+    '''
+    Returns an FdMover for the given directory where the platform supports
+    one, and a Mover elsewhere.
+    '''
+    if DIR_FD_SUPPORTED:
+        return FdMover(root_dir, dirs)
+    return Mover(root_dir, dirs)
+
+
+def stamp(mover, name, file_type):
+    '''
+    Returns the (inode, size, mtime) stamp of the given file in its category
+    subdirectory, or None if it can't be stat-ed.
+    '''
+    try:
+        stat = mover.stat(name, file_type)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def plan_moves_back(mover, moves, stamps=None):
+    '''
+    Splits the given (name, file type) moves into those that can be moved
+    back, those missing from their category subdirectory, those whose name is
+    taken in the directory, and those that no longer match the stamps, keyed
+    by name, that were taken when they were moved, keeping their order. The
+    directory and each category subdirectory are listed once, and only files
+    with a stamp are stat-ed, once each.
+    '''
+    with mover.scandir() as entries:
+        taken = set(entry.name for entry in entries)
+    listings = {}
+    to_move, missing, conflicting, changed = [], [], [], []
+    for name, file_type in moves:
+        present = listings.get(file_type)
+        if present is None:
+            try:
+                present = set(mover.listdir(file_type))
+            except OSError:
+                present = set()
+            listings[file_type] = present
+        if name not in present:
+            missing.append((name, file_type))
+        elif name in taken:
+            conflicting.append((name, file_type))
+        elif stamps and stamps.get(name) and \
+                stamp(mover, name, file_type) != tuple(stamps[name]):
+            changed.append((name, file_type))
+        else:
+            to_move.append((name, file_type))
+    return to_move, missing, conflicting, changed
+
+
+def run_ordered(function, items, jobs=1):
+    '''
+    Calls the given function with the arguments in each of the given items,
+    on a pool of the given number of threads. Yields an (item, error) pair for
+    each item in the order of the items, where error is the OSError raised by
+    its call or None. Only a few calls per thread are queued at a time, so the
+    items are consumed as calls complete rather than all up front.
+    '''
+    def call(item):
+        try:
+            function(*item)
+        except OSError as error:
+            return item, error
+        return item, None
+
+    if jobs <= 1:
+        for item in items:
+            yield call(item)
+        return
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(call, item))
+            if len(pending) >= jobs * QUEUED_PER_JOB:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
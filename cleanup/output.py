@@ -0,0 +1,229 @@
+'''
+Buffered console output. The lines printed for every file moved are collected
+and written out in large chunks, rather than each with a write of its own,
+while other lines are written out right away, along with the lines collected
+before them, so that the output is the same as if every line was printed.
+
+Instead of a line for every file, a status line with the progress made can be
+kept at the bottom of the output, and redrawn every so often.
+'''
+
+import atexit
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from huepy import *
+
+# characters collected before they are written out
+BUFFER_SIZE = 64 * 1024
+
+# seconds after which collected lines are written out anyway
+FLUSH_INTERVAL = 0.1
+
+# seconds for which a status line is left before it is redrawn
+REDRAW_INTERVAL = 0.1
+
+# moves the cursor back to the start of the line and clears the line
+CLEAR_LINE = '\r\x1b[K'
+
+
+class Output:
+    '''
+    Collects lines and writes them to standard output in chunks, at the
+    latest FLUSH_INTERVAL after the first of them was collected, above the
+    status line if there is one. Safe to use from several threads, each of
+    which can group the lines it writes so that they are written out
+    together.
+    '''
+
+    def __init__(self):
+        self.lines = []
+        self.size = 0
+        self.timer = None
+        self.status = None
+        self.shown = False
+        self.lock = threading.Lock()
+        # the lines grouped by each thread
+        self.local = threading.local()
+
+    def write(self, line):
+        group = getattr(self.local, 'group', None)
+        if group is not None:
+            group.append(line + '\n')
+            return
+        with self.lock:
+            self.lines.append(line + '\n')
+            self.size += len(line) + 1
+            if self.size >= BUFFER_SIZE:
+                self.write_out()
+            elif self.timer is None:
+                self.timer = threading.Timer(FLUSH_INTERVAL, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self, line=None):
+        '''
+        Writes out the collected lines, followed by the given line if any.
+        Lines grouped by the calling thread are left until the group ends.
+        '''
+        group = getattr(self.local, 'group', None)
+        if group is not None:
+            if line is not None:
+                group.append(line + '\n')
+            return
+        with self.lock:
+            if line is not None:
+                self.lines.append(line + '\n')
+            self.write_out()
+
+    @contextmanager
+    def grouped(self):
+        '''
+        Holds back the lines that the calling thread writes for the duration
+        of a with statement, and then writes them out together, so that they
+        aren't interleaved with the lines of other threads.
+        '''
+        self.local.group = []
+        try:
+            yield
+        finally:
+            group = self.local.group
+            self.local.group = None
+            with self.lock:
+                self.lines.extend(group)
+                self.write_out()
+
+    def show_status(self, status):
+        '''
+        Replaces the status line with the given one, or removes it if None,
+        writing out the collected lines above it.
+        '''
+        with self.lock:
+            self.status = status
+            self.write_out(redraw=True)
+
+    def close(self):
+        '''
+        Writes out the collected lines, and ends the status line if there is
+        one, so that nothing is written after it.
+        '''
+        with self.lock:
+            self.write_out()
+            if self.shown:
+                sys.stdout.write('\n')
+                sys.stdout.flush()
+                self.status = None
+                self.shown = False
+
+    def write_out(self, redraw=False):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.lines and not redraw:
+            return
+        text = ''.join(self.lines)
+        if self.shown:
+            text = CLEAR_LINE + text
+        if self.status is not None:
+            text += self.status
+        sys.stdout.write(text)
+        sys.stdout.flush()
+        self.shown = self.status is not None
+        self.lines = []
+        self.size = 0
+
+
+def describe_files(counts):
+    '''
+    Returns how many files there are of each type, given a Counter of them,
+    as in '3 files (Audio 1, Text 2)'.
+    '''
+    total = sum(counts.values())
+    return (str(total) + (' file (' if total == 1 else ' files (')
+            + ', '.join(file_type + ' ' + str(count)
+                        for file_type, count in sorted(counts.items()))
+            + ')')
+
+
+def format_size(size):
+    for unit in ('B', 'kB', 'MB', 'GB'):
+        if size < 1000:
+            break
+        size /= 1000
+    else:
+        unit = 'TB'
+    if unit == 'B':
+        return '%d B' % size
+    return '%.1f %s' % (size, unit)
+
+
+def format_duration(seconds):
+    return '%d:%02d' % divmod(int(seconds), 60)
+
+
+class Progress:
+    '''
+    Shows the progress of moving the given number of files on a status line:
+    how many were moved, how many a second, their total size, how many of
+    each type, and how long the rest will take. The line is redrawn at most
+    once every REDRAW_INTERVAL, however fast files are moved, and only if
+    standard output is a terminal, so that a log only gets the summary.
+    '''
+
+    def __init__(self, total):
+        self.total = total
+        self.shown = sys.stdout.isatty()
+        self.moved = 0
+        self.size = 0
+        self.counts = Counter()
+        self.start = time.monotonic()
+        self.draw(self.start)
+
+    def update(self, file_type, size=None):
+        '''
+        Counts a file of the given type and size, if known, as moved.
+        '''
+        self.moved += 1
+        self.counts[file_type] += 1
+        if size:
+            self.size += size
+        now = time.monotonic()
+        if now - self.drawn >= REDRAW_INTERVAL:
+            self.draw(now)
+
+    def draw(self, now):
+        self.drawn = now
+        if not self.shown:
+            return
+        elapsed = now - self.start
+        rate = self.moved / elapsed if elapsed > 0 else 0
+        if rate:
+            left = format_duration((self.total - self.moved) / rate)
+        else:
+            left = '-:--'
+        parts = [bold('%d/%d' % (self.moved, self.total)) + ' files',
+                 '%d files/s' % rate, format_size(self.size)]
+        if self.counts:
+            parts.append(', '.join(
+                file_type + ' ' + str(count)
+                for file_type, count in sorted(self.counts.items())))
+        parts.append('ETA ' + left)
+        output.show_status('  '.join(parts))
+
+    def finish(self, operation):
+        '''
+        Replaces the status line with a summary of the given operation.
+        '''
+        if self.shown:
+            output.show_status(None)
+        output.flush(operation + ' ' + lightgreen('complete') + '! '
+                     + describe_files(self.counts) + ', '
+                     + format_size(self.size) + ' in '
+                     + '%.1fs' % (time.monotonic() - self.start))
+
+
+output = Output()
+atexit.register(output.close)
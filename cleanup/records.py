@@ -0,0 +1,148 @@
+'''
+A compact text format for revert records, grouped by file type, with the
+names of each group sorted and front-coded.
+
+A record is a JSON header line followed by the files it lists:
+  {"path": "/dir", "count": 3}
+  =Audio
+  0 song-01.mp3
+  6 2.mp3
+  =Text
+  0 notes.txt
+Each file type is written once, on a line starting with '=', and each name as
+the number of characters it shares with the name before it in its group,
+followed by the rest of the name. The number may be followed by the inode,
+size and modification time in nanoseconds of the file when it was moved,
+separated by colons, as in '6:1234:5678:1565000000000000000 2.mp3'.
+Backslashes and newlines in names are escaped. A record cut short, by an
+interruption while it was being appended, lists fewer files than its header
+counts and is left out when reading.
+'''
+
+import json
+import re
+
+ESCAPE = re.compile(r'\\(.)', re.DOTALL)
+
+
+def encode_name(name):
+    return name.replace('\\', '\\\\').replace('\n', '\\n') \
+        .encode('utf8', 'surrogateescape')
+
+
+def unescape(match):
+    return '\n' if match.group(1) == 'n' else match.group(1)
+
+
+def decode_name(data):
+    name = data.decode('utf8', 'surrogateescape')
+    if '\\' in name:
+        name = ESCAPE.sub(unescape, name)
+    return name
+
+
+def group_files(files):
+    '''
+    Returns the names of the given {'name', 'type'} files grouped by type.
+    '''
+    groups = {}
+    for file_info in files:
+        groups.setdefault(file_info['type'], []).append(file_info['name'])
+    return groups
+
+
+def file_stamps(files):
+    '''
+    Returns the (inode, size, mtime) stamps of those of the given files that
+    have one, keyed by name.
+    '''
+    return {file_info['name']: file_info['stamp'] for file_info in files
+            if file_info.get('stamp')}
+
+
+def shared_length(previous, name):
+    limit = min(len(previous), len(name))
+    shared = 0
+    while shared < limit and previous[shared] == name[shared]:
+        shared += 1
+    return shared
+
+
+def encode_record(header, groups, stamps=None):
+    '''
+    Yields the lines of a record with the given header dict, to which the
+    count of files is added, the given {file type: names} groups, and the
+    given stamps of files, keyed by name.
+    '''
+    header = dict(header, count=sum(map(len, groups.values())))
+    yield (json.dumps(header) + '\n').encode()
+    for file_type in sorted(groups):
+        yield b'=' + encode_name(file_type) + b'\n'
+        previous = ''
+        for name in sorted(groups[file_type]):
+            shared = shared_length(previous, name)
+            stamp = stamps.get(name) if stamps else None
+            if stamp:
+                yield b'%d:%d:%d:%d %s\n' % (shared, stamp[0], stamp[1],
+                                             stamp[2],
+                                             encode_name(name[shared:]))
+            else:
+                yield b'%d %s\n' % (shared, encode_name(name[shared:]))
+            previous = name
+
+
+def iter_records(lines, file_types=None):
+    '''
+    Yields a (header, [(file type, names, stamps), ...]) pair for each
+    complete record in the given lines, read as a stream, where stamps holds
+    the stamp of each name, or None for names without one. Only the groups of
+    the given file types are yielded if any are given, and the names of the
+    others are counted without being decoded.
+    '''
+    header = groups = names = stamps = None
+    count = 0
+    previous = ''
+    for line in lines:
+        if not line.endswith(b'\n'):
+            break
+        first = line[:1]
+        if first == b'{':
+            if header is not None and count == header['count']:
+                yield header, groups
+            header = json.loads(line)
+            groups = []
+            count = 0
+        elif first == b'=':
+            file_type = decode_name(line[1:-1])
+            if file_types is None or file_type in file_types:
+                names = []
+                stamps = []
+                groups.append((file_type, names, stamps))
+            else:
+                names = None
+            previous = ''
+        elif names is None:
+            count += 1
+        else:
+            shared, _, rest = line[:-1].partition(b' ')
+            stamp = None
+            if b':' in shared:
+                shared, inode, size, mtime = shared.split(b':')
+                stamp = int(inode), int(size), int(mtime)
+            stamps.append(stamp)
+            previous = previous[:int(shared)] + decode_name(rest)
+            names.append(previous)
+            count += 1
+    if header is not None and count == header['count']:
+        yield header, groups
+
+
+def flatten(groups):
+    '''
+    Returns the {'name', 'type'} files in the given (file type, names, stamps)
+    groups, along with the 'stamp' of those that have one.
+    '''
+    return [{'name': name, 'type': file_type} if stamp is None
+            else {'name': name, 'type': file_type, 'stamp': stamp}
+            for file_type, names, stamps in groups
+            for name, stamp in zip(names, stamps)]
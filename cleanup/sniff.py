@@ -0,0 +1,214 @@
+'''
+Identify files without a known extension by the magic bytes they start with.
+'''
+
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+from .extension_table import FILE_TYPES
+
+# most bytes read from any one file
+SNIFF_BYTES = 512
+
+# files read at once, so that slow disks can serve several requests together
+SNIFF_JOBS = 8
+
+# the numbers of the TIFF tags that tell raw camera images apart
+TIFF_MAKE = 0x010f
+TIFF_DNG_VERSION = 0xc612
+# the TIFF field type of strings
+TIFF_ASCII = 2
+
+# The extension of raw camera images that are TIFF files, by the start of the
+# camera maker in their Make tag.
+TIFF_MAKES = [
+    (b'NIKON', 'NEF'),
+    (b'SONY', 'ARW'),
+    (b'PENTAX', 'PEF'),
+    (b'RICOH', 'PEF'),
+    (b'SAMSUNG', 'SRW'),
+    (b'Hasselblad', '3FR'),
+    (b'Phase One', 'IIQ'),
+    (b'Leaf', 'MOS'),
+    (b'Mamiya', 'MEF'),
+    (b'KODAK', 'KDC'),
+    (b'Kodak', 'KDC'),
+]
+
+# The extension of files in the ISO base media format by the major brand in
+# their ftyp box. Files of other brands are left unmatched rather than guessed
+# at, as the format holds still images and raw camera images as well as video.
+ISO_BRANDS = {
+    b'avif': 'AVIF', b'avis': 'AVIF',
+    b'crx ': 'CR3',
+    b'heic': 'HEIC', b'heix': 'HEIC', b'heim': 'HEIC', b'heis': 'HEIC',
+    b'hevc': 'HEIC', b'hevx': 'HEIC', b'mif1': 'HEIF', b'msf1': 'HEIF',
+    b'M4A ': 'M4A', b'M4B ': 'M4B', b'M4V ': 'M4V', b'M4VH': 'M4V',
+    b'3gp4': '3GP', b'3gp5': '3GP', b'3gp6': '3GP', b'3ge6': '3GP',
+    b'3g2a': '3G2', b'3g2b': '3G2', b'3g2c': '3G2',
+    b'qt  ': 'MOV',
+    b'f4v ': 'F4V',
+    b'isom': 'MP4', b'iso2': 'MP4', b'iso4': 'MP4', b'iso5': 'MP4',
+    b'iso6': 'MP4', b'mp41': 'MP4', b'mp42': 'MP4', b'avc1': 'MP4',
+    b'dash': 'MP4', b'mmp4': 'MP4', b'MSNV': 'MP4', b'NDAS': 'MP4',
+}
+
+
+def match_tiff(head):
+    '''
+    Returns the extension of a TIFF file, given its leading bytes, by the tags
+    they hold of its first image directory: that of a raw camera image if
+    there is a DNGVersion tag or a Make tag of a known maker, and TIF if not.
+    '''
+    order = '<' if head[:2] == b'II' else '>'
+    try:
+        offset, = struct.unpack_from(order + 'I', head, 4)
+        count, = struct.unpack_from(order + 'H', head, offset)
+        for entry in range(offset + 2, offset + 2 + count * 12, 12):
+            tag, kind, length, value = struct.unpack_from(order + 'HHII',
+                                                          head, entry)
+            if tag == TIFF_DNG_VERSION:
+                return 'DNG'
+            if tag == TIFF_MAKE and kind == TIFF_ASCII:
+                if length <= 4:
+                    make = head[entry + 8:entry + 8 + length]
+                else:
+                    make = head[value:value + length]
+                for prefix, extension in TIFF_MAKES:
+                    if make.startswith(prefix):
+                        return extension
+    except struct.error:
+        # the directory runs past the bytes read
+        pass
+    return 'TIF'
+
+
+def match_iso_brand(head):
+    '''
+    Returns the extension of a file in the ISO base media format, given its
+    leading bytes, by its major brand, or None if the brand isn't known.
+    '''
+    return ISO_BRANDS.get(head[8:12])
+
+
+# Each signature is an extension and the (offset, bytes) pairs that a file of
+# that type starts with, where an offset of None matches anywhere in the bytes
+# read. In place of the extension, a function can be given that returns it,
+# or None, given the bytes read. More specific signatures come before the
+# ones they share bytes with.
+SIGNATURES = [
+    ('CR2', ((0, b'II*\x00'), (8, b'CR'))),
+    ('ORF', ((0, b'IIRO'),)),
+    ('ORF', ((0, b'IIRS'),)),
+    (match_tiff, ((0, b'II*\x00'),)),
+    (match_tiff, ((0, b'MM\x00*'),)),
+    (match_iso_brand, ((4, b'ftyp'),)),
+    ('JPG', ((0, b'\xff\xd8\xff'),)),
+    ('PNG', ((0, b'\x89PNG\r\n\x1a\n'),)),
+    ('GIF', ((0, b'GIF87a'),)),
+    ('GIF', ((0, b'GIF89a'),)),
+    ('PSD', ((0, b'8BPS'),)),
+    ('WEBP', ((0, b'RIFF'), (8, b'WEBP'))),
+    ('WAV', ((0, b'RIFF'), (8, b'WAVE'))),
+    ('AVI', ((0, b'RIFF'), (8, b'AVI '))),
+    ('WEBM', ((0, b'\x1aE\xdf\xa3'), (None, b'webm'))),
+    ('MKV', ((0, b'\x1aE\xdf\xa3'),)),
+    ('FLV', ((0, b'FLV\x01'),)),
+    ('MPG', ((0, b'\x00\x00\x01\xba'),)),
+    ('WMV', ((0, b'0&\xb2u\x8ef\xcf\x11'),)),
+    ('MP3', ((0, b'ID3'),)),
+    ('MP3', ((0, b'\xff\xfb'),)),
+    ('FLAC', ((0, b'fLaC'),)),
+    ('OGG', ((0, b'OggS'),)),
+    ('PDF', ((0, b'%PDF-'),)),
+    ('PS', ((0, b'%!PS'),)),
+    ('RTF', ((0, b'{\\rtf'),)),
+    ('EPUB', ((0, b'PK\x03\x04'), (30, b'mimetypeapplication/epub+zip'))),
+    ('ZIP', ((0, b'PK\x03\x04'),)),
+    ('GZ', ((0, b'\x1f\x8b'),)),
+    ('BZ2', ((0, b'BZh'),)),
+    ('XZ', ((0, b'\xfd7zXZ\x00'),)),
+    ('7Z', ((0, b"7z\xbc\xaf'\x1c"),)),
+    ('RAR', ((0, b'Rar!\x1a\x07'),)),
+    ('TAR', ((257, b'ustar'),)),
+    ('SQLITE', ((0, b'SQLite format 3\x00'),)),
+    ('EXE', ((0, b'MZ'),)),
+    ('ELF', ((0, b'\x7fELF'),)),
+    ('WOFF', ((0, b'wOFF'),)),
+    ('WOFF2', ((0, b'wOF2'),)),
+    ('TTF', ((0, b'\x00\x01\x00\x00\x00'),)),
+]
+
+
+def match_signature(head):
+    '''
+    Returns the extension of the first signature that the given leading bytes
+    of a file match, or None if none of them do.
+    '''
+    for extension, patterns in SIGNATURES:
+        for offset, magic in patterns:
+            if offset is None:
+                if magic not in head:
+                    break
+            elif head[offset:offset + len(magic)] != magic:
+                break
+        else:
+            if callable(extension):
+                return extension(head)
+            return extension
+    return None
+
+
+def read_head(path, budget=SNIFF_BYTES):
+    '''
+    Returns up to the given number of bytes from the start of a file.
+    '''
+    fd = os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+    try:
+        if hasattr(os, 'pread'):
+            return os.pread(fd, budget, 0)
+        return os.read(fd, budget)
+    finally:
+        os.close(fd)
+
+
+def sniff(path, budget=SNIFF_BYTES):
+    '''
+    Returns the extension that matches the content of the given file, or None
+    if it can't be read or doesn't match any known signature.
+    '''
+    try:
+        return match_signature(read_head(path, budget))
+    except OSError:
+        return None
+
+
+def sniff_many(paths, jobs=SNIFF_JOBS):
+    '''
+    Yields the sniffed extension of each of the given files, in order, reading
+    up to the given number of files at once.
+    '''
+    if jobs <= 1:
+        yield from map(sniff, paths)
+        return
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        yield from executor.map(sniff, paths)
+
+
+def classify_by_content(root_dir, classified, jobs=SNIFF_JOBS):
+    '''
+    Passes through the (name, extension, file type) tuples of the given
+    classified files in the given directory, holding back the ones without a
+    known extension. Those are yielded last, with the extension and file type
+    that their content matches.
+    '''
+    unmatched = []
+    for name, extension, file_type in classified:
+        if extension:
+            yield name, extension, file_type
+        else:
+            unmatched.append(name)
+    paths = [os.path.join(root_dir, name) for name in unmatched]
+    for name, extension in zip(unmatched, sniff_many(paths, jobs)):
+        yield name, extension, FILE_TYPES[extension] if extension else None
@@ -0,0 +1,323 @@
+#! /usr/bin/env python3
+
+'''
+A revert store backed by SQLite, for querying the revert history of many
+directories at once. It provides the same functions as the journal store, and
+is used instead of it with --store sqlite.
+
+Every cleanup, and every batch of files moved by a watch, is a run. A run is
+pending until it is reverted. The pending runs of a directory make up its
+generations, each of which is a cleanup along with the watch batches that
+followed it.
+
+The store can be queried by running this module:
+  python3 -m cleanup.sqlite_store <command>
+
+Usage:
+  sqlite_store pending
+  sqlite_store moved <name>
+
+Commands:
+  pending   List the directories that have a cleanup to revert.
+  moved     List the runs that moved a file with the given name.
+'''
+
+import os
+import sqlite3
+import time
+
+from docopt import docopt
+
+DB_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                       'revert_info.db')
+
+# seconds to wait for another process to finish writing
+BUSY_TIMEOUT = 30
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    time REAL NOT NULL,
+    extend INTEGER NOT NULL,
+    -- the generation of the directory that the run is part of
+    generation INTEGER,
+    -- or 'reverted', or 'replaced' by versions that kept a single generation
+    state TEXT NOT NULL DEFAULT 'pending'
+);
+CREATE INDEX IF NOT EXISTS runs_path ON runs (path, state);
+CREATE INDEX IF NOT EXISTS runs_state ON runs (state, path);
+CREATE TABLE IF NOT EXISTS moves (
+    run INTEGER NOT NULL REFERENCES runs (id),
+    name TEXT NOT NULL,
+    type TEXT NOT NULL,
+    -- the stamp of the file when it was moved, if it could be taken
+    inode INTEGER,
+    size INTEGER,
+    mtime INTEGER
+);
+CREATE INDEX IF NOT EXISTS moves_run ON moves (run, type);
+CREATE INDEX IF NOT EXISTS moves_name ON moves (name);
+CREATE INDEX IF NOT EXISTS moves_type ON moves (type);
+'''
+
+
+def connect():
+    '''
+    Returns a connection to the store, creating it the first time. The store
+    is kept in WAL mode, so that reading it never waits for a cleanup that is
+    writing to it.
+    '''
+    connection = sqlite3.connect(DB_FILE, timeout=BUSY_TIMEOUT)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.executescript(SCHEMA)
+    columns = [column for _, column, *_
+               in connection.execute('PRAGMA table_info(moves)')]
+    if 'inode' not in columns:
+        # a store created before moves were stamped
+        with connection:
+            for column in ('inode', 'size', 'mtime'):
+                connection.execute('ALTER TABLE moves ADD COLUMN %s INTEGER'
+                                   % column)
+    columns = [column for _, column, *_
+               in connection.execute('PRAGMA table_info(runs)')]
+    if 'generation' not in columns:
+        # a store created before generations were recorded, whose pending
+        # runs are numbered as they were then, by counting them
+        with connection:
+            connection.execute('ALTER TABLE runs ADD COLUMN generation '
+                               'INTEGER')
+            generations = {}
+            for run, path, extend in connection.execute(
+                    "SELECT id, path, extend FROM runs "
+                    "WHERE state = 'pending' ORDER BY id").fetchall():
+                if not extend or path not in generations:
+                    generations[path] = generations.get(path, 0) + 1
+                connection.execute(
+                    'UPDATE runs SET generation = ? WHERE id = ?',
+                    (generations[path], run))
+    return connection
+
+
+def latest_generation(connection, abs_path):
+    '''
+    Returns the generation of the latest pending run of the given directory,
+    or 0 if there isn't one.
+    '''
+    return connection.execute(
+        "SELECT COALESCE(MAX(generation), 0) FROM runs WHERE path = ? "
+        "AND state = 'pending'", (abs_path,)).fetchone()[0]
+
+
+def move_info(name, file_type, inode, size, mtime):
+    file_info = {'name': name, 'type': file_type}
+    if inode is not None:
+        file_info['stamp'] = (inode, size, mtime)
+    return file_info
+
+
+def append_revert_list(abs_path, revert_list, extend=False):
+    '''
+    Records the given revert list for the given directory as a run, in one
+    transaction, which starts the next generation of the directory unless
+    extend is set, in which case it is part of the latest one. Marks the
+    pending runs of the directory as reverted if the list is None.
+    '''
+    if revert_list is None:
+        drop_generations(abs_path, 0)
+        return
+    connection = connect()
+    try:
+        with connection:
+            generation = latest_generation(connection, abs_path)
+            if not extend or not generation:
+                generation += 1
+            run = connection.execute(
+                'INSERT INTO runs (path, time, extend, generation) '
+                'VALUES (?, ?, ?, ?)',
+                (abs_path, time.time(), extend, generation)).lastrowid
+            connection.executemany(
+                'INSERT INTO moves (run, name, type, inode, size, mtime) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                ((run, file_info['name'], file_info['type'])
+                 + tuple(file_info.get('stamp') or (None, None, None))
+                 for file_info in revert_list))
+    finally:
+        connection.close()
+
+
+def read_revert_list(abs_path):
+    '''
+    Returns the revert list of the pending runs of the given directory, or None
+    if there aren't any.
+    '''
+    connection = connect()
+    try:
+        runs = connection.execute("SELECT id FROM runs WHERE path = ? "
+                                  "AND state = 'pending' ORDER BY id",
+                                  (abs_path,)).fetchall()
+        if not runs:
+            return None
+        revert_list = []
+        for run, in runs:
+            revert_list.extend(
+                move_info(*move) for move in connection.execute(
+                    'SELECT name, type, inode, size, mtime FROM moves '
+                    'WHERE run = ? ORDER BY rowid', (run,)))
+        return revert_list
+    finally:
+        connection.close()
+
+
+def pending_runs(connection, abs_path):
+    '''
+    Returns the (generation, run id, time) of each pending run of the given
+    directory, oldest first.
+    '''
+    return connection.execute(
+        "SELECT generation, id, time FROM runs WHERE path = ? "
+        "AND state = 'pending' ORDER BY id", (abs_path,)).fetchall()
+
+
+def read_generations(abs_path, after=0, file_types=None):
+    '''
+    Returns a (generation, time, revert list) tuple for each generation of the
+    given directory after the given one, oldest first, with only the moves of
+    the given file types if any are given.
+    '''
+    query = 'SELECT name, type, inode, size, mtime FROM moves WHERE run = ?'
+    if file_types is not None:
+        file_types = list(file_types)
+        query += ' AND type IN (%s)' % ', '.join('?' * len(file_types))
+    connection = connect()
+    try:
+        generations = []
+        for generation, run, run_time in pending_runs(connection, abs_path):
+            if generation <= after:
+                continue
+            if not generations or generations[-1][0] != generation:
+                generations.append((generation, int(run_time), []))
+            generations[-1][2].extend(
+                move_info(*move) for move in connection.execute(
+                    query + ' ORDER BY rowid', [run] + (file_types or [])))
+        return generations
+    finally:
+        connection.close()
+
+
+def last_generation(abs_path):
+    '''
+    Returns the latest generation of the given directory, or 0 if there isn't
+    one.
+    '''
+    connection = connect()
+    try:
+        return latest_generation(connection, abs_path)
+    finally:
+        connection.close()
+
+
+def drop_generations(abs_path, generation, selected=None):
+    '''
+    Marks the runs of the generations of the given directory after the given
+    one as reverted. If a function is given, only the moves of those runs
+    that it selects, by name and file type, are reverted instead, by moving
+    them to a reverted copy of their run, and a generation is marked as
+    reverted once none of its moves are left.
+    '''
+    connection = connect()
+    try:
+        with connection:
+            runs = [(run_generation, run) for run_generation, run, _
+                    in pending_runs(connection, abs_path)
+                    if run_generation > generation]
+            if selected is not None:
+                emptied = set(run_generation for run_generation, run in runs)
+                for run_generation, run in runs:
+                    moves = connection.execute(
+                        'SELECT rowid, name, type FROM moves WHERE run = ?',
+                        (run,)).fetchall()
+                    dropped = [rowid for rowid, name, file_type in moves
+                               if selected(name, file_type)]
+                    if dropped:
+                        copy = connection.execute(
+                            'INSERT INTO runs '
+                            '(path, time, extend, generation, state) '
+                            "SELECT path, time, extend, generation, "
+                            "'reverted' FROM runs WHERE id = ?",
+                            (run,)).lastrowid
+                        connection.executemany(
+                            'UPDATE moves SET run = ? WHERE rowid = ?',
+                            ((copy, rowid) for rowid in dropped))
+                    if len(dropped) < len(moves):
+                        emptied.discard(run_generation)
+                runs = [(run_generation, run) for run_generation, run in runs
+                        if run_generation in emptied]
+            connection.executemany(
+                "UPDATE runs SET state = 'reverted' WHERE id = ?",
+                ((run,) for run_generation, run in runs))
+    finally:
+        connection.close()
+
+
+def read_revert_info():
+    '''
+    Returns the revert lists of all the directories with pending runs, keyed
+    by the absolute paths of the directories.
+    '''
+    connection = connect()
+    try:
+        revert_info = {}
+        for path, *move in connection.execute(
+                'SELECT path, name, type, inode, size, mtime FROM runs '
+                "JOIN moves ON run = id WHERE state = 'pending' "
+                'ORDER BY id, moves.rowid'):
+            revert_info.setdefault(path, []).append(move_info(*move))
+        return revert_info
+    finally:
+        connection.close()
+
+
+def pending_dirs():
+    '''
+    Returns the sorted paths of the directories that have pending runs.
+    '''
+    connection = connect()
+    try:
+        return [path for path, in connection.execute(
+            "SELECT DISTINCT path FROM runs WHERE state = 'pending' "
+            'ORDER BY path')]
+    finally:
+        connection.close()
+
+
+def find_moves(name):
+    '''
+    Returns a (directory, run id, time, file type, state) tuple for each run
+    that moved a file with the given name, oldest first.
+    '''
+    connection = connect()
+    try:
+        return connection.execute(
+            'SELECT path, id, time, type, state FROM moves JOIN runs '
+            'ON run = id WHERE name = ? ORDER BY id', (name,)).fetchall()
+    finally:
+        connection.close()
+
+
+def main():
+    arguments = docopt(__doc__)
+    if arguments['pending']:
+        for path in pending_dirs():
+            print(path)
+    else:
+        for path, run, run_time, file_type, state in \
+                find_moves(arguments['<name>']):
+            print(time.strftime('%Y-%m-%d %H:%M:%S',
+                                time.localtime(run_time))
+                  + '  run ' + str(run) + '  ' + state + '  '
+                  + os.path.join(path, file_type, arguments['<name>']))
+
+
+if __name__ == '__main__':
+    main()
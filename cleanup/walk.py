@@ -0,0 +1,80 @@
+'''
+Apply an operation to every directory in a tree, in parallel.
+'''
+
+import os
+import queue
+import threading
+
+# threads used to walk a tree when no number of jobs is given
+WALK_JOBS = 8
+
+
+def list_subdirs(path, skip=()):
+    '''
+    Returns the paths of the subdirectories of the given directory, leaving
+    out those with a name in skip and symbolic links to directories.
+    '''
+    try:
+        with os.scandir(path) as entries:
+            return [entry.path for entry in entries
+                    if entry.name not in skip
+                    and entry.is_dir(follow_symlinks=False)]
+    except OSError:
+        return []
+
+
+def walk_parallel(abs_path, function, jobs=WALK_JOBS):
+    '''
+    Calls the given function with the given directory and with every
+    directory below it. Directories are taken from a shared queue by a pool of
+    the given number of threads. A directory is listed for subdirectories
+    after the function has run on it, so that files it moved away aren't
+    listed, and subdirectories with a name in the collection the function
+    returns for it, if any, are left out. Symbolic links are not followed, and
+    a directory reached twice, through a bind mount for instance, is only
+    visited once. The first exception raised by the function is raised again
+    once the walk is over.
+    '''
+    work = queue.Queue()
+    seen = set()
+    errors = []
+    lock = threading.Lock()
+
+    def enqueue(path):
+        try:
+            stat = os.stat(path, follow_symlinks=False)
+        except OSError:
+            return
+        with lock:
+            if (stat.st_dev, stat.st_ino) in seen:
+                return
+            seen.add((stat.st_dev, stat.st_ino))
+        work.put(path)
+
+    def worker():
+        while True:
+            path = work.get()
+            if path is None:
+                break
+            skip = None
+            try:
+                skip = function(path)
+            except Exception as error:
+                errors.append(error)
+            for subdir in list_subdirs(path, skip or ()):
+                enqueue(subdir)
+            work.task_done()
+
+    enqueue(abs_path)
+    threads = [threading.Thread(target=worker, daemon=True)
+               for _ in range(max(jobs, 1))]
+    for thread in threads:
+        thread.start()
+    work.join()
+    for _ in threads:
+        work.put(None)
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
@@ -26,6 +26,9 @@ setup(
     ],
     keywords='cleanup file-organiser file-organisation file-management hue docopt',
     packages=find_packages(exclude=['test']),
+    package_data={
+        'cleanup': ['file_types.bin'],
+    },
     install_requires=['docopt', 'huepy'],
     extras_require={
         'dev': ['pylint'],
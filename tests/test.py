@@ -1,17 +1,585 @@
 #! /usr/bin/env python3
 
+import io
+import os
+import shutil
+import struct
 import sys
+import tempfile
+import threading
+import time
+from collections import Counter
 from os.path import join, dirname, realpath
 
+from docopt import DocoptExit
 from huepy import *
 
 sys.path.append(join(dirname(realpath(__file__)), '..', 'cleanup'))
 # import from cleanup after adding it's path to the system path
-from cleanup.cleanup import cleanup, revert, read_revert_info
+from cleanup.cleanup import (cleanup, revert, watch, get_longest_extension,
+                             classify_many, rescan, find_settled,
+                             recorded_types, parse_number)
+from cleanup.extension_table import FILE_TYPES, ExtensionTable
+from cleanup.file_types import FILE_TYPES as SOURCE_FILE_TYPES
+from cleanup import journal, records, sqlite_store
+from cleanup.journal import read_revert_info
+from cleanup.move import (DIR_FD_SUPPORTED, open_mover, plan_moves_back,
+                          run_ordered, stamp)
+from cleanup.output import CLEAR_LINE, Progress, describe_files, output
+from cleanup.sniff import (ISO_BRANDS, SIGNATURES, TIFF_MAKES,
+                           match_signature)
+from cleanup.walk import walk_parallel
 
 TEST_FILES_DIR = join(dirname(realpath(__file__)), 'files')
 
 
+def test_longest_extension():
+    assert get_longest_extension('archive.Tar.gz') == 'TAR.GZ'
+    assert get_longest_extension('backup.2019.pkg.tar.xz') == 'PKG.TAR.XZ'
+    assert get_longest_extension('photo.JpG') == 'JPG'
+    assert get_longest_extension('.gz') == 'GZ'
+    assert get_longest_extension('notes..gz') == 'GZ'
+    assert get_longest_extension('notes.') is None
+    assert get_longest_extension('README') is None
+    assert get_longest_extension('notes.unknownext') is None
+
+
+def test_classify_many():
+    names = ['a.tar.gz', 'b.TAR.GZ', 'c.backup.gz', 'tar.gz', 'd.gz', 'e.tar',
+             'README', 'notes.', 'f.unknownext', 'g.pkg.tar.xz', 'h.tar.xz']
+    for name, extension, file_type in classify_many(names):
+        assert extension == get_longest_extension(name), name
+        assert file_type == (FILE_TYPES[extension] if extension else None)
+
+
+def test_extension_table():
+    # file_types.bin must be rebuilt whenever file_types.py changes
+    assert len(FILE_TYPES) == len(SOURCE_FILE_TYPES)
+    assert dict(FILE_TYPES) == SOURCE_FILE_TYPES
+    assert FILE_TYPES.get('not-an-extension') is None
+    # a table first looked up from several threads at once is loaded once
+    for _ in range(20):
+        table = ExtensionTable()
+        found = []
+        threads = [threading.Thread(
+            target=lambda: found.append(table.trie['JPG']['.']))
+            for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert found == ['JPG'] * 8
+
+
+def test_sniff():
+    extensions = [extension for extension, _ in SIGNATURES
+                  if not callable(extension)]
+    extensions += list(ISO_BRANDS.values()) + ['TIF', 'DNG']
+    extensions += [extension for _, extension in TIFF_MAKES]
+    for extension in extensions:
+        assert extension in FILE_TYPES, extension
+    assert match_signature(b'\x89PNG\r\n\x1a\n\x00\x00') == 'PNG'
+    assert match_signature(b'RIFF\x00\x00\x00\x00WAVEfmt ') == 'WAV'
+    assert match_signature(b'\x1aE\xdf\xa3\x01\x00B\x82\x84webm') == 'WEBM'
+    assert match_signature(b'plain text') is None
+    # ISO base media files by their brand, and none for unknown brands
+    assert match_signature(b'\x00\x00\x00\x18ftypmp42') == 'MP4'
+    assert match_signature(b'\x00\x00\x00\x18ftypcrx ') == 'CR3'
+    assert match_signature(b'\x00\x00\x00\x1cftypavif') == 'AVIF'
+    assert match_signature(b'\x00\x00\x00\x18ftypzzzz') is None
+    # raw camera images that are TIFF files by their tags
+    def tiff(tag, value):
+        return (b'II*\x00\x08\x00\x00\x00\x01\x00'
+                + struct.pack('<HHII', tag, 2, len(value), 22) + value)
+
+    assert match_signature(tiff(0x010f, b'NIKON CORPORATION\x00')) == 'NEF'
+    assert match_signature(tiff(0x010f, b'SONY\x00')) == 'ARW'
+    assert match_signature(tiff(0xc612, b'\x01\x04\x00\x00')) == 'DNG'
+    assert match_signature(tiff(0x010f, b'EPSON scanner\x00')) == 'TIF'
+    assert match_signature(b'MM\x00*\x00\x00\x00\x08') == 'TIF'
+
+    with tempfile.TemporaryDirectory() as dir:
+        with open(join(dir, 'DSC0001'), 'wb') as file:
+            file.write(b'\xff\xd8\xff\xe0\x00\x10JFIF')
+        with open(join(dir, 'notes'), 'wb') as file:
+            file.write(b'plain text')
+        cleanup(dir, silent=True, sniff=True)
+        assert os.path.isfile(join(dir, 'Raster image', 'DSC0001'))
+        assert os.path.isfile(join(dir, 'notes'))
+        revert(dir, silent=True)
+        assert os.path.isfile(join(dir, 'DSC0001'))
+
+
+def test_run_ordered():
+    def fail_on_odd(number):
+        if number % 2:
+            raise OSError(number)
+
+    items = [(number,) for number in range(100)]
+    results = list(run_ordered(fail_on_odd, iter(items), jobs=4))
+    assert [item for item, _ in results] == items
+    assert [error is None for _, error in results] == \
+        [number % 2 == 0 for number in range(100)]
+
+
+def test_mover_follows_renamed_dir():
+    if not DIR_FD_SUPPORTED:
+        return
+    with tempfile.TemporaryDirectory() as parent:
+        dir = join(parent, 'before')
+        os.mkdir(dir)
+        for name in ('a.txt', 'b.txt'):
+            open(join(dir, name), 'w').close()
+        with open_mover(dir) as mover:
+            mover.move('a.txt', 'Text')
+            os.rename(dir, join(parent, 'after'))
+            mover.move('b.txt', 'Text')
+        assert sorted(os.listdir(join(parent, 'after', 'Text'))) == \
+            ['a.txt', 'b.txt']
+
+
+def test_plan_moves_back():
+    with tempfile.TemporaryDirectory() as dir:
+        os.mkdir(join(dir, 'Text'))
+        for path in (('Text', 'a.txt'), ('Text', 'b.txt'), ('b.txt',),
+                     ('Text', 'e.txt')):
+            open(join(dir, *path), 'w').close()
+        moves = [('a.txt', 'Text'), ('b.txt', 'Text'), ('c.txt', 'Text'),
+                 ('d.mp3', 'Audio'), ('e.txt', 'Text')]
+        with open_mover(dir) as mover:
+            # e.txt was replaced by another file since it was stamped
+            stamps = {'a.txt': stamp(mover, 'a.txt', 'Text'),
+                      'e.txt': (0, 0, 0)}
+            assert plan_moves_back(mover, moves, stamps) == \
+                ([('a.txt', 'Text')], [('c.txt', 'Text'), ('d.mp3', 'Audio')],
+                 [('b.txt', 'Text')], [('e.txt', 'Text')])
+
+
+def test_recursive():
+    with tempfile.TemporaryDirectory() as dir:
+        os.makedirs(join(dir, 'a', 'b'))
+        # a directory of the user's, named like a file type
+        os.makedirs(join(dir, 'a', 'Video'))
+        for path in (('x.mp3',), ('a', 'y.txt'), ('a', 'b', 'z.png'),
+                     ('a', 'Video', 'v.txt')):
+            open(join(dir, *path), 'w').close()
+        try:
+            os.symlink(dir, join(dir, 'a', 'loop'))
+        except (AttributeError, NotImplementedError, OSError):
+            # Windows without the privilege to create symbolic links
+            pass
+
+        def clean(path):
+            cleanup(path, silent=True)
+            return recorded_types(path)
+
+        def unclean(path):
+            skip = recorded_types(path)
+            revert(path, silent=True)
+            return skip
+
+        walk_parallel(dir, clean)
+        assert os.path.isfile(join(dir, 'Audio', 'x.mp3'))
+        assert os.path.isfile(join(dir, 'a', 'Text', 'y.txt'))
+        assert os.path.isfile(join(dir, 'a', 'b', 'Raster image', 'z.png'))
+        assert os.path.isfile(join(dir, 'a', 'Video', 'Text', 'v.txt'))
+        assert not os.path.exists(join(dir, 'Audio', 'Audio'))
+        walk_parallel(dir, unclean)
+        assert os.path.isfile(join(dir, 'x.mp3'))
+        assert os.path.isfile(join(dir, 'a', 'b', 'z.png'))
+        assert os.path.isfile(join(dir, 'a', 'Video', 'v.txt'))
+
+
+def test_watch():
+    saved = sys.stdout
+    with tempfile.TemporaryDirectory() as dir:
+        sys.stdout = io.StringIO()
+        try:
+            watched = join(dir, 'watched')
+            os.mkdir(watched)
+            thread = threading.Thread(target=watch, args=(watched, True),
+                                      daemon=True)
+            thread.start()
+            time.sleep(0.2)
+            # a file that arrives while a cleanup is running waits for it
+            wal = journal.WriteAheadLog(watched)
+            with open(join(watched, 'a.txt'), 'w') as file:
+                file.write('arrived')
+            time.sleep(1)
+            assert os.path.isfile(join(watched, 'a.txt'))
+            wal.remove()
+            deadline = time.monotonic() + 30
+            while journal.read_revert_list(watched) is None:
+                assert time.monotonic() < deadline
+                time.sleep(0.1)
+            assert os.path.isfile(join(watched, 'Text', 'a.txt'))
+            assert [(file_info['name'], file_info['type']) for file_info
+                    in journal.read_revert_list(watched)] == \
+                [('a.txt', 'Text')]
+            # the watch ends once the directory is gone
+            shutil.rmtree(watched)
+            thread.join(10)
+            assert not thread.is_alive()
+            assert 'The directory is gone' in sys.stdout.getvalue()
+        finally:
+            sys.stdout = saved
+
+
+def test_parse_number():
+    arguments = {'--jobs': '4', '--to': None, '--settle': 'x'}
+    assert parse_number(arguments, '--jobs', int, 1) == 4
+    assert parse_number(arguments, '--to', int, 0) is None
+    for option, value in (('--settle', 'x'), ('--jobs', '0')):
+        try:
+            parse_number(dict(arguments, **{option: value}), option, int, 1)
+        except DocoptExit:
+            pass
+        else:
+            assert False, option
+
+
+def test_poll_snapshot():
+    with tempfile.TemporaryDirectory() as dir:
+        open(join(dir, 'a.txt'), 'w').close()
+        snapshot = {}
+        with open_mover(dir) as mover:
+            assert rescan(mover, snapshot, 0)
+            assert not rescan(mover, snapshot, 1)
+        assert find_settled(dir, snapshot, 1, 5) == ([], False)
+        assert find_settled(dir, snapshot, 5, 5) == (['a.txt'], False)
+        with open(join(dir, 'a.txt'), 'w') as file:
+            file.write('still being written')
+        assert find_settled(dir, snapshot, 6, 5) == ([], True)
+        assert find_settled(dir, snapshot, 10, 5) == ([], False)
+        assert find_settled(dir, snapshot, 11, 5) == (['a.txt'], False)
+
+
+class Terminal(io.StringIO):
+    def isatty(self):
+        return True
+
+
+def test_progress():
+    saved = sys.stdout
+    texts = []
+    try:
+        for stdout in (Terminal(), io.StringIO()):
+            sys.stdout = stdout
+            progress = Progress(1000)
+            for i in range(1000):
+                progress.update('Text' if i % 2 else 'Audio', 10)
+            progress.finish('Cleanup')
+            texts.append(sys.stdout.getvalue())
+    finally:
+        sys.stdout = saved
+    summary = ('Cleanup ' + lightgreen('complete')
+               + '! 1000 files (Audio 500, Text 500), 10.0 kB in ')
+    # redrawn once at the start, and at most every REDRAW_INTERVAL after
+    text = texts[0]
+    assert text.count(CLEAR_LINE) <= 3
+    assert text.endswith(CLEAR_LINE + summary + text.rsplit(' in ', 1)[1])
+    # and never redrawn in a log
+    text = texts[1]
+    assert text.startswith(summary) and text.count('\n') == 1
+    assert describe_files(Counter(['Text'])) == '1 file (Text 1)'
+
+
+def test_grouped_output():
+    saved = sys.stdout
+    sys.stdout = io.StringIO()
+    try:
+        def write(name):
+            with output.grouped():
+                for i in range(100):
+                    output.write(name)
+                output.flush(name + ' done')
+
+        threads = [threading.Thread(target=write, args=(name,))
+                   for name in 'abcd']
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        lines = sys.stdout.getvalue().splitlines()
+    finally:
+        sys.stdout = saved
+    for start in range(0, len(lines), 101):
+        name = lines[start]
+        assert lines[start:start + 101] == [name] * 100 + [name + ' done']
+
+
+def test_journal():
+    saved = (journal.STORE_DIR, journal.LEGACY_JOURNAL_FILE,
+             journal.LEGACY_REVERT_INFO_FILE)
+    with tempfile.TemporaryDirectory() as dir:
+        journal.STORE_DIR = join(dir, 'revert_info')
+        journal.LEGACY_JOURNAL_FILE = join(dir, 'revert_info.jsonl')
+        journal.LEGACY_REVERT_INFO_FILE = join(dir, 'revert_info.json')
+        try:
+            with open(journal.LEGACY_REVERT_INFO_FILE, 'w') as file:
+                file.write('{"/old": [{"name": "a.txt", "type": "Text"}]}')
+            a = [{'name': 'a.txt', 'type': 'Text'}]
+            b = [{'name': 'b.mp3', 'type': 'Audio'}]
+            assert journal.read_revert_list('/old') == a
+            assert not os.path.exists(journal.LEGACY_REVERT_INFO_FILE)
+            journal.append_revert_list('/dir', a)
+            journal.append_revert_list('/dir', b, extend=True)
+            journal.append_revert_list('/dir/sub', b)
+            assert journal.read_revert_list('/dir') == a + b
+            journal.append_revert_list('/dir', b)
+            assert [(generation, files) for generation, _, files
+                    in journal.read_generations('/dir')] == \
+                [(1, a + b), (2, b)]
+            assert [generation for generation, _ in
+                    journal.read_index('/dir')] == [1, 2]
+            assert [files for _, _, files
+                    in journal.read_generations('/dir', 1)] == [b]
+            # an index that is out of date is not relied on
+            journal.write_index('/dir', [(2, 0)])
+            assert journal.last_generation('/dir') == 2
+            journal.drop_generations('/dir', 1)
+            assert journal.read_revert_list('/dir') == a + b
+            journal.append_revert_list('/dir', None)
+            assert journal.read_revert_list('/dir') is None
+            assert read_revert_info() == {'/old': a, '/dir/sub': b}
+            # appends from several threads at once all make it in
+            threads = [threading.Thread(
+                target=journal.append_revert_list,
+                args=('/dir', [{'name': str(i), 'type': 'Text'}], True))
+                for i in range(16)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert len(journal.read_revert_list('/dir')) == 16
+            # a generation that only a watch added to has a time, unlike one
+            # recorded before times were
+            [(_, run_time, _)] = journal.read_generations('/dir')
+            assert run_time is not None
+            [(_, run_time, _)] = journal.read_generations('/old')
+            assert run_time is None
+            journal.append_revert_list('/dir', None)
+            # each directory has a journal of its own
+            assert len([name for name in os.listdir(journal.STORE_DIR)
+                        if name.endswith(journal.JOURNAL_SUFFIX)]) == 2
+            # while the lock files are shared, so there are never more than 256
+            for i in range(50):
+                journal.append_revert_list('/many/' + str(i), a)
+                journal.append_revert_list('/many/' + str(i), None)
+            locks = [name for name in os.listdir(journal.STORE_DIR)
+                     if name.endswith(journal.LOCK_SUFFIX)
+                     and name != journal.MIGRATION_LOCK_FILE]
+            assert all(len(name) == journal.LOCK_KEY_LENGTH
+                       + len(journal.LOCK_SUFFIX) for name in locks)
+        finally:
+            (journal.STORE_DIR, journal.LEGACY_JOURNAL_FILE,
+             journal.LEGACY_REVERT_INFO_FILE) = saved
+
+
+def test_records():
+    files = [{'name': name, 'type': 'Text'}
+             for name in ('notes-2.txt', 'notes-10.txt', 'a\\b\nc.txt')]
+    files.append({'name': 'song.mp3', 'type': 'Audio', 'stamp': (1, 2, 3)})
+    lines = list(records.encode_record({'path': '/dir'},
+                                       records.group_files(files),
+                                       records.file_stamps(files)))
+    assert lines[2] == b'0:1:2:3 song.mp3\n'
+    assert lines[4] == b'0 a\\\\b\\nc.txt\n' and lines[6] == b'6 2.txt\n'
+    [(header, groups)] = records.iter_records(lines)
+    assert header == {'path': '/dir', 'count': 4}
+    assert sorted(records.flatten(groups), key=str) == \
+        sorted(files, key=str)
+    # a record cut short is left out
+    assert list(records.iter_records(lines[:-1])) == []
+    assert len(list(records.iter_records(lines + lines[:-1]))) == 1
+
+
+def test_sqlite_store():
+    saved = sqlite_store.DB_FILE
+    with tempfile.TemporaryDirectory() as dir:
+        sqlite_store.DB_FILE = join(dir, 'revert_info.db')
+        try:
+            a = [{'name': 'a.txt', 'type': 'Text'}]
+            b = [{'name': 'b.mp3', 'type': 'Audio'}]
+            sqlite_store.append_revert_list('/dir', a)
+            sqlite_store.append_revert_list('/dir', b, extend=True)
+            sqlite_store.append_revert_list('/dir/sub', b)
+            assert sqlite_store.read_revert_list('/dir') == a + b
+            sqlite_store.append_revert_list('/dir', b)
+            assert [(generation, files) for generation, _, files
+                    in sqlite_store.read_generations('/dir')] == \
+                [(1, a + b), (2, b)]
+            sqlite_store.drop_generations('/dir', 1)
+            assert sqlite_store.read_revert_list('/dir') == a + b
+            sqlite_store.drop_generations(
+                '/dir', 0, lambda name, file_type: file_type == 'Audio')
+            assert sqlite_store.read_revert_list('/dir') == a
+            sqlite_store.append_revert_list('/dir', b, extend=True)
+            assert sqlite_store.pending_dirs() == ['/dir', '/dir/sub']
+            sqlite_store.append_revert_list('/dir', None)
+            assert sqlite_store.read_revert_list('/dir') is None
+            assert sqlite_store.read_revert_info() == {'/dir/sub': b}
+            assert [(path, state) for path, _, _, _, state
+                    in sqlite_store.find_moves('b.mp3')] == \
+                [('/dir/sub', 'pending'), ('/dir', 'reverted'),
+                 ('/dir', 'reverted'), ('/dir', 'reverted')]
+        finally:
+            sqlite_store.DB_FILE = saved
+
+
+def test_generations():
+    with tempfile.TemporaryDirectory() as dir:
+        for names in (['a.txt'], ['a.txt', 'b.mp3'], ['c.mp3']):
+            for name in names:
+                open(join(dir, name), 'w').close()
+            cleanup(dir, silent=True)
+        assert [generation for generation, _, _
+                in journal.read_generations(dir)] == [1, 2, 3]
+        revert(dir, silent=True)
+        assert sorted(os.listdir(dir)) == ['Audio', 'Text', 'c.mp3']
+        # a.txt was moved twice, and goes back with a single rename
+        revert(dir, silent=True, to=0)
+        assert sorted(os.listdir(dir)) == ['a.txt', 'b.mp3', 'c.mp3']
+        assert journal.read_generations(dir) == []
+    # both stores keep the numbers of the generations left after a selective
+    # revert empties one of them
+    for store in (journal, sqlite_store):
+        with tempfile.TemporaryDirectory() as dir:
+            for name in ('a.txt', 'b.mkv', 'c.mp3'):
+                open(join(dir, name), 'w').close()
+                cleanup(dir, silent=True, store=store)
+            revert(dir, silent=True, store=store, to=0, file_types=['Video'])
+            assert [generation for generation, _, _
+                    in store.read_generations(dir)] == [1, 3]
+            revert(dir, silent=True, store=store, to=2)
+            assert os.path.isfile(join(dir, 'c.mp3'))
+            cleanup(dir, silent=True, store=store)
+            assert store.last_generation(dir) == 2
+
+
+def test_selective_revert():
+    with tempfile.TemporaryDirectory() as dir:
+        for names in (['a.txt', 'b.mkv'], ['c.mkv', 'd.mp4', 'e.mp3']):
+            for name in names:
+                open(join(dir, name), 'w').close()
+            cleanup(dir, silent=True)
+        revert(dir, silent=True, to=0, file_types=['Video'], pattern='*.mkv')
+        assert sorted(os.listdir(join(dir, 'Video'))) == ['d.mp4']
+        assert os.path.isfile(join(dir, 'b.mkv'))
+        assert os.path.isfile(join(dir, 'c.mkv'))
+        assert [(generation, [file_info['name'] for file_info in files])
+                for generation, _, files in journal.read_generations(dir)] == \
+            [(1, ['a.txt']), (2, ['e.mp3', 'd.mp4'])]
+        assert [file_info['name'] for file_info
+                in journal.read_generations(dir, 0, ['Video'])[-1][2]] == \
+            ['d.mp4']
+        revert(dir, silent=True, to=0)
+        assert sorted(os.listdir(dir)) == \
+            ['a.txt', 'b.mkv', 'c.mkv', 'd.mp4', 'e.mp3']
+
+
+def test_revert_keeps_files_left_in_place():
+    with tempfile.TemporaryDirectory() as dir:
+        open(join(dir, 'a.txt'), 'w').close()
+        cleanup(dir, silent=True)
+        open(join(dir, 'a.txt'), 'w').close()
+        revert(dir, silent=True)
+        assert os.path.isfile(join(dir, 'Text', 'a.txt'))
+        os.rename(join(dir, 'a.txt'), join(dir, 'b.txt'))
+        revert(dir, silent=True)
+        assert sorted(os.listdir(dir)) == ['a.txt', 'b.txt']
+        assert journal.read_generations(dir) == []
+
+
+def test_revert_forgets_missing_files():
+    with tempfile.TemporaryDirectory() as dir:
+        for name in ('a.txt', 'b.txt', 'c.mp3'):
+            open(join(dir, name), 'w').close()
+        cleanup(dir, silent=True)
+        os.remove(join(dir, 'Text', 'a.txt'))
+        revert(dir, silent=True)
+        assert sorted(os.listdir(dir)) == ['b.txt', 'c.mp3']
+        assert journal.read_generations(dir) == []
+
+
+def test_interrupted_cleanup():
+    with tempfile.TemporaryDirectory() as dir:
+        for name in ('a.txt', 'b.txt', 'c.mp3'):
+            open(join(dir, name), 'w').close()
+
+        def interrupt():
+            # as if cleanup was interrupted after moving a.txt of a batch
+            wal = journal.WriteAheadLog(dir)
+            wal.log([('a.txt', 'Text'), ('b.txt', 'Text')])
+            wal.close()
+            os.mkdir(join(dir, 'Text'))
+            os.rename(join(dir, 'a.txt'), join(dir, 'Text', 'a.txt'))
+
+        # a cleanup that is still running is not taken for interrupted
+        wal = journal.WriteAheadLog(dir)
+        assert not journal.is_interrupted(dir)
+        cleanup(dir, silent=True, resume=True)
+        assert not os.path.exists(join(dir, 'Text'))
+        wal.remove()
+
+        interrupt()
+        cleanup(dir, silent=True)
+        assert os.path.isfile(join(dir, 'c.mp3'))
+        revert(dir, silent=True)
+        assert sorted(os.listdir(dir)) == ['a.txt', 'b.txt', 'c.mp3']
+        assert not journal.is_interrupted(dir)
+
+        interrupt()
+        cleanup(dir, silent=True, resume=True)
+        assert sorted(os.listdir(join(dir, 'Text'))) == ['a.txt', 'b.txt']
+        assert os.path.isfile(join(dir, 'Audio', 'c.mp3'))
+        assert not journal.is_interrupted(dir)
+        revert(dir, silent=True, jobs=4)
+        assert sorted(os.listdir(dir)) == ['a.txt', 'b.txt', 'c.mp3']
+
+
+def test_output():
+    saved = sys.stdout
+    with tempfile.TemporaryDirectory() as dir:
+        files_dir = join(dir, 'files')
+        shutil.copytree(TEST_FILES_DIR, files_dir)
+        try:
+            sys.stdout = io.StringIO()
+            cleanup(files_dir)
+            cleanup_text = sys.stdout.getvalue()
+            moves = journal.read_revert_list(files_dir)
+            sys.stdout = io.StringIO()
+            revert(files_dir)
+            revert_text = sys.stdout.getvalue()
+        finally:
+            sys.stdout = saved
+
+    # the output is the same as when every line was printed as it came, with
+    # the moves in the order they were made rather than the recorded one
+    def same_output(text, printed):
+        lines = text.splitlines(True)
+        expected = printed.getvalue().splitlines(True)
+        return (lines[0] == expected[0] and lines[-1] == expected[-1]
+                and sorted(lines[1:-1]) == sorted(expected[1:-1]))
+
+    printed = io.StringIO()
+    print('Cleaning up ' + bold(lightblue(files_dir)) + ':', file=printed)
+    for file_info in moves:
+        print(lightgreen('Moved') + ' ' + bold(file_info['name']) + ' under '
+              + bold(file_info['type']), file=printed)
+    print('Cleanup ' + lightgreen('complete') + '!', file=printed)
+    assert same_output(cleanup_text, printed)
+    printed = io.StringIO()
+    print('Reverting cleanup of ' + bold(lightblue(files_dir)) + ':',
+          file=printed)
+    for file_info in moves:
+        print(lightgreen('Moved back') + ' ' + bold(file_info['name'])
+              + ' from ' + bold(file_info['type']), file=printed)
+    print('Revert ' + lightgreen('complete') + '!', file=printed)
+    assert same_output(revert_text, printed)
+    assert len(moves) == len(os.listdir(TEST_FILES_DIR))
+
+
 def test_cleanup():
     print(bold(yellow('Testing cleanup:')))
     cleanup(TEST_FILES_DIR)
@@ -23,6 +591,41 @@ def test_revert():
     revert(TEST_FILES_DIR)
 
 
+def use_store(dir):
+    '''
+    Keeps the revert info of the tests in the given directory, rather than in
+    the store of the package, where it would be left behind.
+    '''
+    journal.STORE_DIR = join(dir, 'revert_info')
+    journal.LEGACY_JOURNAL_FILE = join(dir, 'revert_info.jsonl')
+    journal.LEGACY_REVERT_INFO_FILE = join(dir, 'revert_info.json')
+    sqlite_store.DB_FILE = join(dir, 'revert_info.db')
+
+
 if __name__ == '__main__':
-    test_cleanup()
-    test_revert()
+    with tempfile.TemporaryDirectory() as store_dir:
+        use_store(store_dir)
+        test_longest_extension()
+        test_extension_table()
+        test_classify_many()
+        test_sniff()
+        test_run_ordered()
+        test_mover_follows_renamed_dir()
+        test_plan_moves_back()
+        test_recursive()
+        test_watch()
+        test_parse_number()
+        test_poll_snapshot()
+        test_progress()
+        test_grouped_output()
+        test_journal()
+        test_records()
+        test_sqlite_store()
+        test_generations()
+        test_selective_revert()
+        test_revert_keeps_files_left_in_place()
+        test_revert_forgets_missing_files()
+        test_interrupted_cleanup()
+        test_output()
+        test_cleanup()
+        test_revert()